@@ -1,26 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
 from core.base_agent import BaseAgent
+from core.deadline import is_timeout_error
 from core.enums import AgentState
+from core.verdicts import CodeVerdict
+from core.sandbox import SANDBOX_ENABLED, SandboxError, get_sandbox, summarize_issues
 import ast
+import contextvars
+import os
+import textwrap
+
+# single — один общий промпт, panel — параллельные узкие ревью по аспектам
+CODE_CRITIC_MODE = os.getenv("CODE_CRITIC_MODE", "single")
+# unanimous — одобрить, если одобрили все; majority — больше половины; any — хотя бы один
+CODE_CRITIC_VOTING = os.getenv("CODE_CRITIC_VOTING", "unanimous")
+
+PANEL_ASPECTS = {
+    "correctness": "Проверь ТОЛЬКО корректность: логические ошибки, необработанные исключения, неверную работу с данными.",
+    "security": "Проверь ТОЛЬКО безопасность: проверку подписи initData Telegram, инъекции, XSS, секреты в коде.",
+    "telegram_webapp": "Проверь ТОЛЬКО использование Telegram WebApp API: подключение telegram-web-app.js, Telegram.WebApp.ready(), initData, MainButton, themeParams.",
+    "performance": "Проверь ТОЛЬКО производительность: блокирующие вызовы, лишние запросы, неограниченный рост памяти."
+}
+CODE_CRITIC_ASPECTS = [
+    aspect.strip() for aspect in os.getenv("CODE_CRITIC_ASPECTS", ",".join(PANEL_ASPECTS)).split(",")
+    if aspect.strip()
+]
+_unknown_aspects = [aspect for aspect in CODE_CRITIC_ASPECTS if aspect not in PANEL_ASPECTS]
+if _unknown_aspects or not CODE_CRITIC_ASPECTS:
+    raise ValueError(
+        f"CODE_CRITIC_ASPECTS: неизвестные аспекты {_unknown_aspects or '(список пуст)'}; "
+        f"допустимые: {', '.join(PANEL_ASPECTS)}"
+    )
+
+PANEL_FORMAT = textwrap.dedent("""
+    Код — в сообщении пользователя. Другие аспекты не оценивай. Будь краток.
+    Верни только JSON: {"approved": boolean, "comments": string, "issues": list[string]}
+    approved: true, если по этому аспекту нет существенных проблем.
+""").strip()
 
 
 class CodeCritic(BaseAgent):
+    instructions = textwrap.dedent("""
+        Проверь код Telegram web-app из сообщения пользователя и **обязательно** верни **только** JSON-ответ без дополнительного текста!
+
+        Формат ответа:
+        {
+            "approved": boolean,
+            "comments": string,
+            "issues": list[string]
+        }
+
+        Требования:
+        - approved: true только если нет синтаксических и логических ошибок
+        - comments: общий комментарий по качеству кода
+        - issues: список конкретных проблем
+
+        Пример ответа:
+        {
+            "approved": false,
+            "comments": "Отсутствует обработка ошибок",
+            "issues": ["Нет retry для API запросов", "Нет валидации входных данных"]
+        }
+    """).strip()
+
     def __init__(self):
         super().__init__(
             name="Code Critic",
             role="Ты Senior разработчик. Проверяй качество кода web-app приложений телеграм, находи ошибки и оптимизируй."
         )
 
-    def _extract_code(self, code_block: str) -> str:
-        """Извлекает код из блока с ```python"""
-        try:
-            if '```python' in code_block:
-                return code_block.split('```python')[1].split('```')[0].strip()
-            elif '```' in code_block:
-                return code_block.split('```')[1].split('```')[0].strip()
-            return code_block
-        except IndexError:
-            return code_block
-
     def _validate_python(self, code: str) -> bool:
         """Проверяет синтаксис Python"""
         try:
@@ -30,6 +77,77 @@ class CodeCritic(BaseAgent):
             self._log_thought(f"Syntax error: {str(e)}", "VALIDATION_ERROR")
             return False
 
+    def _smoke_test(self, code: str):
+        """Запускает код в изолированной песочнице; None, если песочница отключена или недоступна"""
+        if not SANDBOX_ENABLED:
+            return None
+        try:
+            report = get_sandbox().smoke_test(code)
+        except SandboxError as e:
+            # Сбой инфраструктуры — не дефект кода: проверка пропускается, ревью продолжается
+            self._log_thought(f"Smoke-тест пропущен: {str(e)}", "WARNING")
+            return None
+        self._log_thought(report, "INFO" if report["passed"] else "WARNING")
+        return report
+
+    def _panel_review(self, prompt: str):
+        """Параллельные короткие ревью по аспектам, сведённые в один вердикт голосованием"""
+        with ThreadPoolExecutor(max_workers=len(CODE_CRITIC_ASPECTS)) as executor:
+            futures = {
+                # Копия контекста на каждый поток: ревью аспекта видит срок этапа
+                aspect: executor.submit(
+                    contextvars.copy_context().run, self._generate_structured, prompt, CodeVerdict, f"{PANEL_ASPECTS[aspect]}\n{PANEL_FORMAT}"
+                )
+                for aspect in CODE_CRITIC_ASPECTS
+            }
+            verdicts = {}
+            for aspect, future in futures.items():
+                try:
+                    verdicts[aspect] = future.result()
+                except Exception as e:
+                    if is_timeout_error(e):
+                        # Не воздерживаться: иначе вердикт вынесли бы без непроверенного аспекта
+                        raise
+                    self._log_thought(f"Ревью аспекта {aspect} не удалось: {str(e)}", "WARNING")
+                    verdicts[aspect] = None
+        return self._merge_verdicts(verdicts)
+
+    @staticmethod
+    def _merge_verdicts(verdicts: dict):
+        """Сводит вердикты аспектов в формат {approved, comments, issues}.
+
+        None — аспект не проголосовал (ошибка или неразборчивый ответ) и считается
+        голосом «не одобрено»: непроверенный аспект не должен пропустить код.
+        """
+        votes = {aspect: verdict for aspect, verdict in verdicts.items() if verdict is not None}
+        if not votes:
+            return None
+
+        approvals = sum(1 for verdict in votes.values() if verdict["approved"])
+        if CODE_CRITIC_VOTING == "majority":
+            approved = approvals * 2 > len(verdicts)
+        elif CODE_CRITIC_VOTING == "any":
+            approved = approvals > 0
+        else:
+            approved = approvals == len(verdicts)
+
+        issues = [f"[{aspect}] Ревью аспекта не выполнено" for aspect, verdict in verdicts.items() if verdict is None]
+        for aspect, verdict in votes.items():
+            for issue in verdict["issues"]:
+                tagged = f"[{aspect}] {issue}"
+                if tagged not in issues:
+                    issues.append(tagged)
+
+        return {
+            "approved": approved,
+            "comments": "; ".join(f"[{aspect}] {verdict['comments']}" for aspect, verdict in votes.items()),
+            "issues": issues,
+            "panel": {
+                aspect: {"approved": verdict["approved"], "comments": verdict["comments"]} if verdict else None
+                for aspect, verdict in verdicts.items()
+            }
+        }
+
     def process_data(self, inputs: dict[str, any]) -> dict[str, any]:
         try:
             # Извлекаем код с обработкой ошибок
@@ -57,63 +175,51 @@ class CodeCritic(BaseAgent):
                     "state": AgentState.ERROR
                 }
 
-            # Генерация запроса с явным указанием формата
-            prompt = textwrap.dedent(f"""
-                Проверь следующий код Telegram web-app и **обязательно** верни **только** JSON-ответ без дополнительного текста!
-
-                Формат ответа:
-                {{
-                    "approved": boolean,
-                    "comments": string,
-                    "issues": list[string]
-                }}
-
-                Требования:
-                - approved: true только если нет синтаксических и логических ошибок
-                - comments: общий комментарий по качеству кода
-                - issues: список конкретных проблем
-
-                Пример ответа:
-                {{
-                    "approved": false,
-                    "comments": "Отсутствует обработка ошибок",
-                    "issues": ["Нет retry для API запросов", "Нет валидации входных данных"]
-                }}
-
-                Код для проверки:
-                {code}
-            """)
-
-            response = self._generate_response(prompt)
-            
-            # Поиск JSON в ответе
-            json_str = response[response.find('{'):response.rfind('}')+1]
-            
-            # Удаляем экранированные символы
-            json_str = json_str.replace('\\', '')
-            
-            # Парсинг JSON
-            try:
-                result = json.loads(json_str)
-                if not isinstance(result.get('issues', []), list):
-                    raise ValueError("Issues should be a list")
-            except Exception as e:
-                self._log_thought(f"JSON parsing error: {str(e)}", "ERROR")
+            # Локальный smoke-тест: импорт и прогон маршрутов приложения в песочнице
+            smoke_test = self._smoke_test(code)
+            if smoke_test is not None and not smoke_test["passed"]:
+                return {
+                    "code_review": {
+                        "approved": False,
+                        "comments": "Код не прошёл локальный smoke-тест",
+                        "issues": summarize_issues(smoke_test),
+                        "smoke_test": smoke_test
+                    },
+                    "state": AgentState.ERROR
+                }
+
+            # Статичные инструкции уходят в системный префикс, в запросе — только код
+            prompt = f"Код для проверки:\n{code}"
+
+            # Вердикт по схеме; для бэкендов без structured output — разбор текста с ранней остановкой
+            if CODE_CRITIC_MODE == "panel":
+                result = self._panel_review(prompt)
+            else:
+                result = self._generate_structured(prompt, CodeVerdict)
+
+            if result is None:
+                self._log_thought("JSON parsing error: вердикт по схеме не найден в ответе", "ERROR")
                 return {
                     "code_review": {
                         "approved": False,
-                        "comments": f"Invalid review format: {str(e)}",
+                        "comments": "Invalid review format: JSON-вердикт не найден",
                         "issues": ["Failed to parse review"]
                     },
                     "state": AgentState.ERROR
                 }
 
+            if smoke_test is not None:
+                result["smoke_test"] = smoke_test
+
             return {
                 "code_review": result,
                 "state": AgentState.CODE_APPROVED if result.get("approved") else AgentState.ERROR
             }
 
         except Exception as e:
+            if is_timeout_error(e):
+                # Истёкший срок — не ошибка ревью: этап отменяет оркестратор
+                raise
             self._log_thought(f"Critical error: {str(e)}", "ERROR")
             return {
                 "code_review": {
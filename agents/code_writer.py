@@ -1,22 +1,177 @@
+from concurrent.futures import ThreadPoolExecutor
 from core.base_agent import BaseAgent
 from core.enums import AgentState
+from core.verdicts import InterfaceContract
+import ast
+import contextvars
+import json
+import os
+import textwrap
+
+# single — один промпт, map_reduce — компоненты параллельно, auto — по размеру требований
+CODE_WRITER_MODE = os.getenv("CODE_WRITER_MODE", "auto")
+CODE_WRITER_SPLIT_CHARS = int(os.getenv("CODE_WRITER_SPLIT_CHARS", "6000"))
+
+CONTRACT_INSTRUCTIONS = textwrap.dedent("""
+    Спроектируй интерфейсный контракт Telegram WebApp по требованиям из сообщения пользователя.
+    Верни только JSON:
+    {
+        "data_model": list[string],
+        "routes": list[string],
+        "page": string
+    }
+    - data_model: классы данных с полями, например "Feedback(email: str, text: str)"
+    - routes: Flask-маршруты в виде "METHOD /path -> handler_name: вход -> выход"
+    - page: что показывает страница и какие маршруты она вызывает через fetch
+""").strip()
+
+# Компоненты склеиваются в этом порядке: модели, затем страница, затем маршруты
+COMPONENT_INSTRUCTIONS = {
+    "data_model": textwrap.dedent("""
+        Напиши ТОЛЬКО слой данных Telegram WebApp по контракту из сообщения пользователя:
+        dataclass-модели из data_model и простое in-memory хранилище с функциями доступа.
+        Не создавай Flask-приложение и маршруты — они будут в другом модуле того же файла.
+        Верни ТОЛЬКО код Python без пояснений, обернув в ```python ... ```
+    """).strip(),
+    "frontend": textwrap.dedent("""
+        Напиши ТОЛЬКО HTML-страницу Telegram WebApp по контракту из сообщения пользователя
+        в виде Python-константы INDEX_HTML = \"\"\"...\"\"\".
+        Подключи telegram-web-app.js, используй Telegram.WebApp и вызывай маршруты из контракта через fetch.
+        Верни ТОЛЬКО код Python без пояснений, обернув в ```python ... ```
+    """).strip(),
+    "backend": textwrap.dedent("""
+        Напиши ТОЛЬКО Flask-бэкенд Telegram WebApp по контракту из сообщения пользователя.
+        Создай app = Flask(__name__) и все маршруты из routes; маршрут "/" отдаёт INDEX_HTML
+        через render_template_string. Модели и функции хранилища из data_model, а также INDEX_HTML
+        уже определены выше в том же файле — не переопределяй их.
+        Верни ТОЛЬКО код Python без пояснений, обернув в ```python ... ```
+    """).strip()
+}
+
 
 class CodeWriter(BaseAgent):
+    instructions = textwrap.dedent("""
+        Напиши код web-app телеграмм приложения строго по требованиям из сообщения пользователя.
+        Если приведена критика предыдущего кода — исправь все перечисленные проблемы.
+        Верни ТОЛЬКО код Python без пояснений, обернув в ```python ... ```
+    """).strip()
+
     def __init__(self):
         super().__init__(
             "Code Writer",
             "Ты Senior Python разработчик с опытом работы в web-app приложениями телеграм. Пиши чистый, эффективный код web-app приложений телеграмм."
         )
 
+    @staticmethod
+    def _feedback(inputs: dict[str, any]) -> str:
+        if 'code_review' not in inputs:
+            return ""
+        return f"""\nКритика предыдущего кода: {inputs['code_review'].get('comments', '')}
+                        Необходимо исправить следующие проблемы: {', '.join(inputs['code_review'].get('issues', []))}"""
+
+    def _use_map_reduce(self, requirements: str) -> bool:
+        if CODE_WRITER_MODE == "auto":
+            return len(requirements) > CODE_WRITER_SPLIT_CHARS
+        return CODE_WRITER_MODE == "map_reduce"
+
     def process_data(self, inputs: dict[str, any]) -> dict[str, any]:
-        prompt = f"""Напиши код web-app телеграмм приложения строго по этим требованиям:\n{inputs['requirements']}\n"""
-        
+        if self._use_map_reduce(inputs['requirements']):
+            merged = self._map_reduce(inputs)
+            if merged is not None:
+                return {"generated_code": f"```python\n{merged}\n```", "state": AgentState.CODE_WRITTEN}
+            self._log_thought("Map-reduce генерация не удалась, генерируем одним запросом", "WARNING")
+
+        prompt = f"""Требования:\n{inputs['requirements']}\n"""
+
         # Include critic feedback if available
-        if 'code_review' in inputs:
-            prompt += f"""\nКритика предыдущего кода: {inputs['code_review'].get('comments', '')}
-                        Необходимо исправить следующие проблемы: {', '.join(inputs['code_review'].get('issues', []))}"""
-                        
-        prompt += "\nВерни ТОЛЬКО код Python без пояснений, обернув в ```python ... ```"
+        prompt += self._feedback(inputs)
 
         response = self._generate_response(prompt)
-        return {"generated_code": response, "state": AgentState.CODE_WRITTEN}
\ No newline at end of file
+        return {"generated_code": response, "state": AgentState.CODE_WRITTEN}
+
+    def _map_reduce(self, inputs: dict[str, any]):
+        """Контракт -> параллельная генерация компонентов -> локальная склейка и проверка.
+
+        Время ограничено самым долгим компонентом, а не суммой. Возвращает
+        склеенный код или None, если собрать валидный модуль не удалось.
+        """
+        contract = self._generate_structured(f"Требования:\n{inputs['requirements']}", InterfaceContract, CONTRACT_INSTRUCTIONS)
+        if contract is None:
+            return None
+        self._log_thought(contract, "INFO")
+
+        payload = (
+            f"Требования:\n{inputs['requirements']}\n\n"
+            f"Контракт:\n{json.dumps(contract, ensure_ascii=False, indent=2)}\n"
+            f"{self._feedback(inputs)}"
+        )
+
+        components = self._generate_components(list(COMPONENT_INSTRUCTIONS), payload)
+        broken = [name for name, code in components.items() if not self._parses(code)]
+        if broken:
+            self._log_thought(f"Компоненты с синтаксическими ошибками, повторная генерация: {broken}", "WARNING")
+            components.update(self._generate_components(broken, payload))
+
+        if not all(self._parses(code) for code in components.values()):
+            return None
+        merged = self._merge([components[name] for name in COMPONENT_INSTRUCTIONS])
+        return merged if self._parses(merged) else None
+
+    def _generate_components(self, names: list, payload: str) -> dict:
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            futures = {
+                name: executor.submit(
+                    contextvars.copy_context().run, self._generate_response, payload, COMPONENT_INSTRUCTIONS[name]
+                )
+                for name in names
+            }
+            return {name: self._extract_code(future.result()) for name, future in futures.items()}
+
+    @staticmethod
+    def _parses(code: str) -> bool:
+        try:
+            ast.parse(code)
+            return True
+        except SyntaxError:
+            return False
+
+    @staticmethod
+    def _merge(parts: list) -> str:
+        """Склеивает компоненты в один модуль, поднимая и дедуплицируя импорты"""
+        future_imports, imports, bodies = [], [], []
+        for code in parts:
+            lines = code.splitlines()
+            # Верхнеуровневые инструкции, сгруппированные по общим строкам ("import os; x = 1")
+            groups = []
+            for node in ast.parse(code).body:
+                start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+                if groups and start < groups[-1][1]:
+                    groups[-1][1] = max(groups[-1][1], node.end_lineno)
+                    groups[-1][2].append(node)
+                else:
+                    groups.append([start, node.end_lineno, [node]])
+
+            replaced = {}
+            for start, end, nodes in groups:
+                rest = [node for node in nodes if not isinstance(node, (ast.Import, ast.ImportFrom))]
+                if len(rest) == len(nodes):
+                    continue
+                for node in nodes:
+                    if node in rest:
+                        continue
+                    statement = ast.unparse(node)
+                    target = future_imports if isinstance(node, ast.ImportFrom) and node.module == "__future__" else imports
+                    if statement not in target:
+                        target.append(statement)
+                # Импорт убирается как узел: соседние инструкции на тех же строках сохраняются
+                replaced[start] = [ast.unparse(node) for node in rest]
+                replaced.update({i: [] for i in range(start + 1, end)})
+
+            body_lines = []
+            for i, line in enumerate(lines):
+                body_lines.extend(replaced[i] if i in replaced else [line])
+            body = "\n".join(body_lines).strip()
+            if body:
+                bodies.append(body)
+        header = "\n".join(future_imports + imports)
+        return "\n\n\n".join(([header] if header else []) + bodies)
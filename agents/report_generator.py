@@ -1,7 +1,17 @@
 from core.base_agent import BaseAgent
 from core.enums import AgentState
+import textwrap
 
 class ReportGenerator(BaseAgent):
+    instructions = textwrap.dedent("""
+        Сформируй итоговый отчет по данным из сообщения пользователя со следующими разделами:
+        1. Исходные требования
+        2. Критика требований
+        3. Сгенерированный код
+        4. Результаты код-ревью
+        5. Итоговые рекомендации
+    """).strip()
+
     def __init__(self):
         super().__init__(
             "Report Generator",
@@ -9,13 +19,6 @@ class ReportGenerator(BaseAgent):
         )
 
     def process_data(self, inputs: dict[str, any]) -> dict[str, any]:
-        prompt = f"""Сформируй итоговый отчет со следующими разделами:
-                1. Исходные требования
-                2. Критика требований
-                3. Сгенерированный код
-                4. Результаты код-ревью
-                5. Итоговые рекомендации
-                
-                Данные: {inputs}"""
-        response = llm.invoke(prompt)
-        return {"final_report": response.content, "state": AgentState.FINISHED}
\ No newline at end of file
+        prompt = f"""Данные: {inputs}"""
+        response = self._generate_response(prompt)
+        return {"final_report": response, "state": AgentState.FINISHED}
\ No newline at end of file
@@ -1,8 +1,20 @@
 from core.base_agent import BaseAgent
 from core.enums import AgentState
-import json
+from core.verdicts import RequirementsVerdict
+import textwrap
 
 class RequirementsCritic(BaseAgent):
+    instructions = textwrap.dedent("""
+        Проанализируй требования из сообщения пользователя.
+        ВАЖНО! Ответ должен быть строго в JSON-формате:
+        {
+            "approved": boolean,
+            "comments": string,
+            "score": integer 1-10
+        }
+        Только JSON без других текстов!
+    """).strip()
+
     def __init__(self):  # Добавленный конструктор
         super().__init__(
             name="Requirements Critic",
@@ -21,32 +33,12 @@ class RequirementsCritic(BaseAgent):
                 "state": AgentState.ERROR
             }
 
-        prompt = f"""Проанализируй следующие требования:
-                {requirements}
-                ВАЖНО! Ответ должен быть строго в JSON-формате:
-                {{
-                    "approved": boolean,
-                    "comments": string,
-                    "score": integer 1-10
-                }}
-                Только JSON без других текстов!"""
+        prompt = f"""Требования:\n{requirements}"""
 
-        
-        try:
-            response = self._generate_response(prompt)
-            
-            # Проверка на пустой ответ
-            if not response.strip():
-                raise ValueError("Empty response received")
-                
-            # Поиск JSON в тексте
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
-            json_str = response[json_start:json_end] if json_start != -1 else response
-            
-            result = json.loads(json_str)
-            
-        except json.JSONDecodeError:
+        # Вердикт по схеме; для бэкендов без structured output — разбор текста с ранней остановкой
+        result = self._generate_structured(prompt, RequirementsVerdict)
+
+        if result is None:
             result = {
                 "approved": False,
                 "comments": "Ошибка формата ответа от LLM",
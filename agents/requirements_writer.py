@@ -1,7 +1,19 @@
 from core.base_agent import BaseAgent
 from core.enums import AgentState
+import textwrap
 
 class RequirementsWriter(BaseAgent):
+    instructions = textwrap.dedent("""
+        На основе запроса пользователя сгенерируй технические требования для Telegram WebApp.
+        Требования должны включать:
+        - Основную функциональность
+        - Структуру интерфейса
+        - Используемые технологии
+        - Пример взаимодействия
+
+        Верни только чёткий и структурированный текст требований без пояснений.
+    """).strip()
+
     def __init__(self):
         super().__init__(
             "Requirements Writer",
@@ -11,19 +23,7 @@ class RequirementsWriter(BaseAgent):
     def process_data(self, inputs):
         user_input = inputs.get('user_input', '')
         
-        prompt = """
-        На основе следующего запроса пользователя:
-        "{user_input}"
-
-        Сгенерируй технические требования для Telegram WebApp.
-        Требования должны включать:
-        - Основную функциональность
-        - Структуру интерфейса
-        - Используемые технологии
-        - Пример взаимодействия
-
-        Верни только чёткий и структурированный текст требований без пояснений.
-        """.format(user_input=user_input)
+        prompt = f'Запрос пользователя:\n"{user_input}"'
         
         response = self._generate_response(prompt)
         return {"requirements": response.strip(), "state": AgentState.REQUIREMENTS_WRITTEN}
\ No newline at end of file
@@ -1,12 +1,141 @@
+import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 
 load_dotenv()
 
-llm = ChatOpenAI(
-    openai_api_key=os.getenv("OPENAI_API_KEY"),
-    model="qwen/qwq-32b:free",
-    base_url="https://openrouter.ai/api/v1",
-    temperature=0.7
-)
\ No newline at end of file
+API_KEY = os.getenv("OPENAI_API_KEY") or os.getenv("OPENROUTER_API_KEY")
+BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "qwen/qwq-32b:free")
+LLM_PROFILES_PATH = os.getenv(
+    "LLM_PROFILES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_profiles.json")
+)
+# Как часто (с) проверять, не изменился ли файл профилей
+PROFILES_CHECK_INTERVAL = 1.0
+
+DEFAULT_CONFIG = {
+    "default_profile": "default",
+    "profiles": {
+        "default": {"model": DEFAULT_MODEL, "temperature": 0.7, "reasoning": True}
+    },
+    "routes": []
+}
+
+
+class ModelRouter:
+    """Выбирает модель для агента по профилям и правилам из JSON-конфига.
+
+    Правило срабатывает, если агент входит в его список "agents" (или список
+    не задан) и длина промпта попадает в [min_prompt_chars, max_prompt_chars].
+    Побеждает первое подходящее правило, иначе используется default_profile.
+    Файл перечитывается при изменении, без перезапуска.
+
+    structured_output профиля — "json_schema", "function_calling" или "none":
+    поддерживает ли бэкенд модели ответ, ограниченный схемой. "reasoning": true —
+    модель рассуждает перед ответом и может начинать их без <think> (см.
+    StreamingJSONExtractor). Профиль без "model" использует LLM_MODEL.
+    """
+
+    def __init__(self, path: str = LLM_PROFILES_PATH):
+        self.path = path
+        self.config = DEFAULT_CONFIG
+        self._mtime = None
+        self._checked_at = 0.0
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < PROFILES_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                config = json.load(f)
+            self._validate(config)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Не удалось загрузить профили моделей {self.path}: {str(e)}")
+            return
+        self.config = config
+        self._mtime = mtime
+
+    @staticmethod
+    def _validate(config: dict):
+        """Новый конфиг принимается, только если все ссылки на профили разрешаются"""
+        profiles = config.get("profiles", {})
+        if config.get("default_profile") not in profiles:
+            raise ValueError("default_profile не найден среди profiles")
+        for i, route in enumerate(config.get("routes", [])):
+            if route.get("profile") not in profiles:
+                raise ValueError(f"routes[{i}]: профиль {route.get('profile')!r} не найден среди profiles")
+
+    def profile_for(self, agent_name: str, prompt: str) -> dict:
+        with self._lock:
+            self._reload_if_changed()
+            config = self.config
+        size = len(prompt)
+        profile_name = config["default_profile"]
+        for route in config.get("routes", []):
+            agents = route.get("agents")
+            if agents and agent_name not in agents:
+                continue
+            if size < route.get("min_prompt_chars", 0):
+                continue
+            if "max_prompt_chars" in route and size > route["max_prompt_chars"]:
+                continue
+            profile_name = route["profile"]
+            break
+        return {"name": profile_name, "model": DEFAULT_MODEL, **config["profiles"][profile_name]}
+
+    def llm_for(self, agent_name: str, prompt: str) -> ChatOpenAI:
+        return self.client_for(self.profile_for(agent_name, prompt))
+
+    def client_for(self, profile: dict) -> ChatOpenAI:
+        """Клиент модели для профиля; клиенты кэшируются по параметрам профиля"""
+        key = (
+            profile["model"],
+            profile.get("temperature", 0.7),
+            profile.get("max_tokens"),
+            profile.get("base_url", BASE_URL)
+        )
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = ChatOpenAI(
+                    openai_api_key=API_KEY,
+                    model=key[0],
+                    temperature=key[1],
+                    max_tokens=key[2],
+                    base_url=key[3],
+                    # Повторы делает BaseAgent._call_llm: через лимитер и с учётом срока этапа
+                    max_retries=0
+                )
+            return self._clients[key]
+
+
+router = ModelRouter()
+
+
+def get_llm(agent_name: str, prompt: str = "") -> ChatOpenAI:
+    return router.llm_for(agent_name, prompt)
+
+
+def get_profile(agent_name: str, prompt: str = "") -> dict:
+    return router.profile_for(agent_name, prompt)
+
+
+def with_timeout(client: ChatOpenAI, seconds: float) -> ChatOpenAI:
+    """Копия клиента с таймаутом запроса; HTTP-пул соединений остаётся общим"""
+    copy = client.model_copy()
+    copy.root_client = client.root_client.with_options(timeout=seconds)
+    copy.client = copy.root_client.chat.completions
+    return copy
@@ -1,15 +1,32 @@
 from langchain.agents import Tool
 from langchain.memory import ConversationBufferMemory
-from langchain.schema import SystemMessage
+from langchain.schema import HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from contextvars import ContextVar
 from datetime import datetime
+import hashlib
 import json
 import textwrap
-from typing import Dict, Any, List, Union
+import time
+from typing import Dict, Any, List, Optional, Union
 
-from config.llm_setup import llm
+from config.llm_setup import get_llm, get_profile, with_timeout
+from core.deadline import DeadlineExceeded, current_deadline, remaining_time
+from core.json_stream import StreamingJSONExtractor
+from core.rate_limiter import (
+    LLM_MAX_RETRIES, estimate_tokens, get_rate_limiter, is_rate_limit_error, is_retryable_error, retry_delay
+)
+from core.verdicts import parse_stats, required_fields
+
+# Журнал текущего workflow, когда один агент обслуживает несколько workflow одновременно
+# (пакетное выполнение этапа); если не задан, записи копятся в agent.logs
+log_sink: ContextVar[Optional[list]] = ContextVar("log_sink", default=None)
 
 class BaseAgent:
+    # Статичные инструкции агента (формат ответа, примеры). Не должны зависеть от входных
+    # данных: вместе с role они образуют байт-в-байт стабильный префикс для кэша провайдера
+    instructions = ""
+
     def __init__(self, name: str, role: str):
         self.name = name
         self.role = role
@@ -27,7 +44,7 @@ class BaseAgent:
             MessagesPlaceholder(variable_name="agent_scratchpad")
         ])
 
-    def _log_thought(self, thought: Union[str, Dict], type: str):
+    def _log_thought(self, thought: Union[str, Dict], type: str, echo: bool = True):
         """Логирует мысли агента в консоль в формате Markdown и сохраняет в историю"""
         # Создаем запись для хранения в памяти
         entry = {
@@ -36,7 +53,10 @@ class BaseAgent:
             "type": type,
             "content": thought
         }
-        self.logs.append(entry)
+        sink = log_sink.get()
+        (self.logs if sink is None else sink).append(entry)
+        if not echo:
+            return
         
         # Формируем цветовой код для типа сообщения
         color_codes = {
@@ -84,32 +104,199 @@ class BaseAgent:
                 f.write('\n')
         self.logs.clear()
 
-    def _generate_response(self, prompt: str) -> str:
+    @staticmethod
+    def _extract_code(code_block: str) -> str:
+        """Извлекает код из блока с ```python"""
+        try:
+            if '```python' in code_block:
+                return code_block.split('```python')[1].split('```')[0].strip()
+            elif '```' in code_block:
+                return code_block.split('```')[1].split('```')[0].strip()
+            return code_block.strip()
+        except IndexError:
+            return code_block.strip()
+
+    def _system_prompt(self, instructions: str = None) -> str:
+        instructions = self.instructions if instructions is None else instructions
+        return f"{self.role}\n\n{instructions}" if instructions else self.role
+
+    def _build_messages(self, prompt: str, instructions: str = None) -> list:
+        """Системный префикс (роль + инструкции) и переменная часть запроса отдельным сообщением"""
+        return [SystemMessage(content=self._system_prompt(instructions)), HumanMessage(content=prompt)]
+
+    def _call_llm(self, prompt: str, instructions: str, runner):
+        """Общий путь вызова модели: маршрутизация, лимитер и логирование.
+
+        runner(llm, messages) выполняет сам запрос и возвращает
+        (результат, сырой текст ответа, usage_metadata, доп. поля для лога).
+        Если задан срок этапа (core.deadline), таймаут HTTP-запроса равен
+        оставшемуся времени, а ожидание в лимитере ограничено им же.
+        Временные ошибки (429, 5xx, сеть) повторяются до LLM_MAX_RETRIES раз,
+        пока пауза перед повтором укладывается в срок.
+        """
         self._log_thought(prompt, "PROMPT")
         
         try:
-            response = llm.invoke(prompt)
-            
-            if not hasattr(response, 'content') or not isinstance(response.content, str):
-                raise ValueError("Ответ модели имеет некорректный тип или формат")
-
-            raw_response = response.content.strip()
-            
-            # Защита от пустого ответа
-            if not raw_response:
-                raise ValueError("Модель вернула пустой ответ. Проверьте API ключ, токены или запрос.")
+            remaining_time()
+            messages = self._build_messages(prompt, instructions)
+            system_prompt = messages[0].content
+            llm = get_llm(self.name, prompt)
+            limiter = get_rate_limiter(llm.model_name)
+            estimated_tokens = estimate_tokens(system_prompt + prompt)
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                started = time.monotonic()
+                try:
+                    with limiter.acquire(estimated_tokens):
+                        remaining = remaining_time()
+                        client = llm if remaining is None else with_timeout(llm, remaining)
+                        result, raw_response, usage, details = runner(client, messages)
+                    break
+                except Exception as e:
+                    if attempt == LLM_MAX_RETRIES or not is_retryable_error(e):
+                        raise
+                    # После 429 паузу по Retry-After выдерживает сам лимитер при следующем acquire
+                    delay = 0.0 if is_rate_limit_error(e) else retry_delay(e, attempt)
+                    deadline = current_deadline.get()
+                    if deadline is not None and delay >= deadline.remaining():
+                        raise
+                    self._log_thought(
+                        f"Повтор запроса {attempt + 1}/{LLM_MAX_RETRIES} через {delay:.1f} с: {str(e)}", "WARNING"
+                    )
+                    time.sleep(delay)
+            latency = time.monotonic() - started
+            limiter.settle(estimated_tokens, usage.get("total_tokens"))
             
             self._log_thought({
                 "raw_response": raw_response[:100] + "..." if len(raw_response) > 100 else raw_response,
                 "length": len(raw_response),
+                **details
             }, "RAW_RESPONSE")
+            self._log_thought({
+                "model": llm.model_name,
+                "prompt_hash": hashlib.sha256(f"{system_prompt}\n{prompt}".encode("utf-8")).hexdigest(),
+                "latency": round(latency, 3),
+                "input_tokens": usage.get("input_tokens"),
+                "cached_tokens": (usage.get("input_token_details") or {}).get("cache_read"),
+                "output_tokens": usage.get("output_tokens"),
+                "response": raw_response
+            }, "LLM_CALL", echo=False)
             
-            return raw_response
+            return result
             
         except Exception as e:
             error_msg = f"Ошибка при генерации ответа: {str(e)}"
             self._log_thought(error_msg, "ERROR")
-            raise RuntimeError(error_msg)
+            raise RuntimeError(error_msg) from e
+
+    def _generate_response(self, prompt: str, instructions: str = None) -> str:
+        def run(llm, messages):
+            response = llm.invoke(messages)
+
+            if not hasattr(response, 'content') or not isinstance(response.content, str):
+                raise ValueError("Ответ модели имеет некорректный тип или формат")
+
+            raw_response = response.content.strip()
+            
+            # Защита от пустого ответа
+            if not raw_response:
+                raise ValueError("Модель вернула пустой ответ. Проверьте API ключ, токены или запрос.")
+
+            return raw_response, raw_response, getattr(response, "usage_metadata", None) or {}, {}
+
+        return self._call_llm(prompt, instructions, run)
+
+    def _generate_json(self, prompt: str, schema: Dict[str, type], instructions: str = None) -> Optional[Dict[str, Any]]:
+        """Стримит ответ и обрывает генерацию, как только пришёл JSON-объект по схеме.
+
+        Возвращает None, если подходящий объект так и не встретился.
+        """
+        reasoning = get_profile(self.name, prompt).get("reasoning", False)
+
+        def run(llm, messages):
+            extractor = StreamingJSONExtractor(schema, reasoning)
+            deadline = current_deadline.get()
+            usage = {}
+            result = None
+            early_stop = False
+            # Без stream_usage провайдер не присылает usage в потоке
+            stream = llm.stream(messages, stream_usage=True)
+            try:
+                for chunk in stream:
+                    # Таймаут клиента ограничивает паузу между чанками, а не весь поток
+                    if deadline is not None and deadline.expired():
+                        raise DeadlineExceeded("Срок истёк во время стриминга ответа")
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    if isinstance(chunk.content, str):
+                        result = extractor.feed(chunk.content)
+                    if result is not None:
+                        early_stop = True
+                        break
+            finally:
+                # Закрытие генератора закрывает HTTP-поток — провайдер прекращает генерацию
+                stream.close()
+            if result is None:
+                result = extractor.finish()
+            details = {"early_stop": early_stop}
+            if not usage:
+                # Usage приходит последним чанком, а при ранней остановке поток до него не доходит:
+                # оцениваем локально, чтобы лимитер всё равно скорректировал ведро токенов
+                input_tokens = sum(len(message.content) for message in messages) // 4
+                output_tokens = len(extractor.text) // 4
+                usage = {
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "total_tokens": input_tokens + output_tokens
+                }
+                details["usage_estimated"] = True
+            return result, extractor.text.strip(), usage, details
+
+        return self._call_llm(prompt, instructions, run)
+
+    def _generate_structured(self, prompt: str, model_cls, instructions: str = None) -> Optional[Dict[str, Any]]:
+        """Запрашивает ответ, ограниченный схемой model_cls (JSON schema / function calling).
+
+        Если профиль модели не поддерживает структурированный вывод, бэкенд его
+        отклонил (400) или ответ не прошёл схему, используется разбор текста через
+        _generate_json. Ошибки транспорта и сроков пробрасываются. Возвращает
+        провалидированный dict или None; в parse_stats попадают только исходы разбора.
+        """
+        profile = get_profile(self.name, prompt)
+        model = profile["model"]
+        mode = profile.get("structured_output", "none")
+
+        if mode != "none":
+            def run(llm, messages):
+                structured = llm.with_structured_output(model_cls, method=mode, include_raw=True)
+                output = structured.invoke(messages)
+                raw = output["raw"]
+                if output.get("parsing_error") or output.get("parsed") is None:
+                    raise ValueError(f"Ответ не соответствует схеме: {output.get('parsing_error')}")
+                raw_text = raw.content if isinstance(raw.content, str) and raw.content else str(raw.tool_calls)
+                usage = getattr(raw, "usage_metadata", None) or {}
+                return output["parsed"].model_dump(), raw_text, usage, {"structured_output": mode}
+
+            try:
+                result = self._call_llm(prompt, instructions, run)
+                parse_stats.record(model, mode, True)
+                return result
+            except RuntimeError as e:
+                if isinstance(e.__cause__, ValueError):
+                    # Ответ пришёл, но не прошёл схему — это и есть отказ разбора
+                    parse_stats.record(model, mode, False)
+                elif getattr(e.__cause__, "status_code", None) != 400:
+                    # 429, 5xx, сеть, истёкший срок — не проблема формата, в статистику не идут
+                    raise
+                # 400: бэкенд не принял response_format/tools — разбираем обычный текст
+                self._log_thought(f"Структурированный вывод не удался, разбираем текст: {str(e)}", "WARNING")
+
+        result = self._generate_json(prompt, required_fields(model_cls), instructions)
+        try:
+            result = model_cls.model_validate(result).model_dump() if result is not None else None
+        except ValueError as e:
+            self._log_thought(f"Вердикт не прошёл валидацию: {str(e)}", "WARNING")
+            result = None
+        parse_stats.record(model, "text", result is not None)
+        return result
 
     def _define_tools(self) -> List[Tool]:
         return [
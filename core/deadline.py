@@ -0,0 +1,68 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Срок одного workflow по умолчанию, с (0 — без срока)
+WORKFLOW_TIMEOUT = float(os.getenv("WORKFLOW_TIMEOUT", "900"))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    """Абсолютный срок (по time.monotonic), который передаётся вниз по вызовам"""
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def child(self, seconds: float) -> "Deadline":
+        """Вложенный срок: не позже родительского"""
+        return Deadline(min(self.expires_at, time.monotonic() + seconds))
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded("Срок выполнения истёк")
+
+
+# Срок текущего этапа; потоки агентов получают его через contextvars.copy_context()
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Сколько секунд осталось у текущего срока (None — срока нет); бросает DeadlineExceeded"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    deadline.check()
+    return deadline.remaining()
+
+
+def is_timeout_error(error: Optional[BaseException]) -> bool:
+    """Истёк ли срок где-то в цепочке исключений (свой DeadlineExceeded или таймаут клиента)"""
+    while error is not None:
+        if isinstance(error, TimeoutError) or type(error).__name__ == "APITimeoutError":
+            return True
+        error = error.__cause__ or error.__context__
+    return False
@@ -7,4 +7,10 @@ class AgentState(Enum):
     CODE_WRITTEN = auto()
     CODE_APPROVED = auto()
     FINISHED = auto()
-    ERROR = auto()
\ No newline at end of file
+    ERROR = auto()
+    TIMEOUT = auto()
+
+
+class Priority(Enum):
+    INTERACTIVE = auto()
+    BATCH = auto()
\ No newline at end of file
@@ -0,0 +1,146 @@
+import json
+from typing import Dict, Any, Optional
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """Длина хвоста text, который может оказаться началом tag в следующем чанке"""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
+
+
+def matches_schema(obj: Any, schema: Dict[str, type]) -> bool:
+    """Проверяет, что объект — dict с нужными ключами нужных типов"""
+    if not isinstance(obj, dict):
+        return False
+    for key, expected in schema.items():
+        if key not in obj or not isinstance(obj[key], expected):
+            return False
+    return True
+
+
+class StreamingJSONExtractor:
+    """Инкрементально ищет в потоке ответа первый JSON-объект верхнего уровня по схеме.
+
+    Блоки рассуждений <think>...</think> пропускаются. feed() возвращает объект,
+    как только закрылась его последняя скобка, — дальше генерацию можно не ждать.
+
+    Модели рассуждений (qwq и т.п.) часто присылают только закрывающий </think>:
+    открывающий подставляет шаблон чата. Поэтому </think> вне блока отбрасывает
+    весь текст до себя, а reasoning=True считает рассуждением всё до первого
+    </think> — иначе черновой JSON из рассуждения вернулся бы как ответ. Если
+    </think> так и не пришёл, finish() разбирает весь поток как ответ.
+    """
+
+    def __init__(self, schema: Dict[str, type], reasoning: bool = False):
+        self.schema = schema
+        self.text = ""
+        self._raw = ""
+        self._in_think = reasoning
+        # Поток до первого </think> в режиме reasoning — на случай, если рассуждений не было
+        self._unclosed = "" if reasoning else None
+        self._reset_scanner()
+
+    def _reset_scanner(self):
+        self.text = ""
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def _strip_reasoning(self, chunk: str) -> str:
+        self._raw += chunk
+        if self._unclosed is not None:
+            self._unclosed += chunk
+        visible = []
+        while True:
+            if self._in_think:
+                end = self._raw.find(THINK_CLOSE)
+                if end == -1:
+                    self._raw = self._raw[len(self._raw) - _partial_tag_length(self._raw, THINK_CLOSE):]
+                    break
+                self._raw = self._raw[end + len(THINK_CLOSE):]
+                self._in_think = False
+                self._unclosed = None
+                continue
+            start = self._raw.find(THINK_OPEN)
+            end = self._raw.find(THINK_CLOSE)
+            if end != -1 and (start == -1 or end < start):
+                # </think> без открывающего: всё до него — рассуждение, включая уже разобранный текст
+                visible.clear()
+                self._reset_scanner()
+                self._raw = self._raw[end + len(THINK_CLOSE):]
+                continue
+            if start == -1:
+                keep = max(_partial_tag_length(self._raw, THINK_OPEN), _partial_tag_length(self._raw, THINK_CLOSE))
+                visible.append(self._raw[:len(self._raw) - keep])
+                self._raw = self._raw[len(self._raw) - keep:]
+                break
+            visible.append(self._raw[:start])
+            self._raw = self._raw[start + len(THINK_OPEN):]
+            self._in_think = True
+        return "".join(visible)
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        # Сначала разбор тегов: </think> может сбросить уже накопленный текст
+        visible = self._strip_reasoning(chunk)
+        self.text += visible
+        while self._pos < len(self.text):
+            char = self.text[self._pos]
+            self._pos += 1
+            if self._start is None:
+                if char == "{":
+                    self._start = self._pos - 1
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = self.text[self._start:self._pos]
+                    start, self._start = self._start, None
+                    try:
+                        obj = json.loads(candidate)
+                    except ValueError:
+                        # Скобка из обычного текста — ищем объект дальше от неё
+                        self._pos = start + 1
+                        continue
+                    if matches_schema(obj, self.schema):
+                        return obj
+        return None
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """Последняя попытка после конца потока: разбор с каждой открывающей скобки"""
+        if self._unclosed is not None and THINK_OPEN not in self._unclosed:
+            # Режим reasoning, но модель ответила без рассуждений
+            self.text = self._unclosed
+        elif not self._in_think:
+            self.text += self._raw
+        self._raw = ""
+        decoder = json.JSONDecoder()
+        index = self.text.find("{")
+        while index != -1:
+            try:
+                obj, _ = decoder.raw_decode(self.text, index)
+            except ValueError:
+                obj = None
+            if matches_schema(obj, self.schema):
+                return obj
+            index = self.text.find("{", index + 1)
+        return None
@@ -0,0 +1,193 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+from core.deadline import DeadlineExceeded, current_deadline
+
+LLM_RPM = float(os.getenv("LLM_RPM", "20"))
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "60"))
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "1024"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов запроса с учётом ожидаемого ответа"""
+    return len(text) // 4 + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Временная ошибка провайдера или сети, после которой запрос стоит повторить"""
+    status = getattr(error, "status_code", None)
+    return (
+        is_rate_limit_error(error)
+        or (status is not None and status >= 500)
+        or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+    )
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Пауза перед повтором: Retry-After провайдера или экспоненциальная с джиттером"""
+    return _retry_after(error) or min(8.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Ведро токенов с резервированием: долг возвращается ожиданием"""
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Списывает amount токенов и возвращает, сколько секунд нужно подождать"""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float):
+        """Корректирует баланс после того, как стало известно фактическое потребление"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveRateLimiter:
+    """Лимитер запросов и токенов для одной модели с AIMD-регулировкой параллелизма"""
+
+    def __init__(
+        self,
+        model: str,
+        requests_per_minute: float = LLM_RPM,
+        tokens_per_minute: float = LLM_TPM,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        latency_target: float = LLM_LATENCY_TARGET
+    ):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 6))
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 6)
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.blocked_until = 0.0
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "throttle_seconds": 0.0}
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def acquire(self, estimated_tokens: int):
+        """Ждёт слот и квоту, затем отдаёт управление на время вызова модели.
+
+        Ожидание ограничено сроком текущего этапа (core.deadline).
+        """
+        deadline = current_deadline.get()
+        waited_from = time.monotonic()
+        with self._cond:
+            self.queue_depth += 1
+            try:
+                while self.in_flight >= int(self.limit) or time.monotonic() < self.blocked_until:
+                    if deadline is not None and deadline.expired():
+                        raise DeadlineExceeded("Срок истёк в очереди лимитера")
+                    self._cond.wait(timeout=max(0.05, self.blocked_until - time.monotonic()))
+            finally:
+                self.queue_depth -= 1
+            self.in_flight += 1
+
+        try:
+            delay = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+            if deadline is not None and delay > deadline.remaining():
+                raise DeadlineExceeded("Квота лимитера не освободится до истечения срока")
+            if delay:
+                time.sleep(delay)
+            with self._cond:
+                self.stats["throttle_seconds"] += time.monotonic() - waited_from
+                self.stats["requests"] += 1
+
+            started = time.monotonic()
+            try:
+                yield self
+            except Exception as e:
+                self._on_error(e)
+                raise
+            self._on_success(time.monotonic() - started)
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Учитывает разницу между оценкой и фактическим расходом токенов"""
+        if actual_tokens:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+    def _on_success(self, latency: float):
+        with self._cond:
+            if latency > self.latency_target:
+                self.limit = max(1.0, self.limit * 0.75)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _on_error(self, error: Exception):
+        with self._cond:
+            if not is_rate_limit_error(error):
+                self.stats["errors"] += 1
+                return
+            self.stats["rate_limited"] += 1
+            self.limit = max(1.0, self.limit / 2)
+            pause = _retry_after(error) or 60 / max(1.0, self.requests.rate * 60)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "model": self.model,
+                "concurrency_limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "queue_depth": self.queue_depth,
+                **self.stats
+            }
+
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> AdaptiveRateLimiter:
+    """Общий на процесс лимитер для модели: его используют все агенты и workflow"""
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = AdaptiveRateLimiter(model)
+        return _limiters[model]
+
+
+def rate_limiter_metrics() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.model: limiter.metrics() for limiter in limiters}
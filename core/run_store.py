@@ -0,0 +1,386 @@
+import argparse
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import DateTime, Float, Integer, String, Text, create_engine, event, insert, inspect, select, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+RUN_STORE_PATH = os.getenv("RUN_STORE_PATH", "agent_runs.db")
+RUN_STORE_BATCH_SIZE = int(os.getenv("RUN_STORE_BATCH_SIZE", "200"))
+RUN_STORE_FLUSH_INTERVAL = float(os.getenv("RUN_STORE_FLUSH_INTERVAL", "2"))
+# Как долго оценка длительности этапа берётся из памяти, а не из БД, с
+STAGE_ESTIMATE_TTL = 60
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Run(Base):
+    __tablename__ = "runs"
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    user_input: Mapped[Optional[str]] = mapped_column(Text)
+    state: Mapped[Optional[str]] = mapped_column(String(32), index=True)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, index=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
+class Stage(Base):
+    __tablename__ = "stages"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    run_id: Mapped[str] = mapped_column(String(36), index=True)
+    stage_index: Mapped[int] = mapped_column(Integer)
+    agent: Mapped[str] = mapped_column(String(64), index=True)
+    state: Mapped[Optional[str]] = mapped_column(String(32), index=True)
+    started_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+    duration: Mapped[float] = mapped_column(Float)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+
+
+class LLMCall(Base):
+    __tablename__ = "llm_calls"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    run_id: Mapped[Optional[str]] = mapped_column(String(36), index=True)
+    agent: Mapped[str] = mapped_column(String(64), index=True)
+    model: Mapped[Optional[str]] = mapped_column(String(128))
+    prompt_hash: Mapped[str] = mapped_column(String(64), index=True)
+    latency: Mapped[Optional[float]] = mapped_column(Float)
+    input_tokens: Mapped[Optional[int]] = mapped_column(Integer)
+    cached_tokens: Mapped[Optional[int]] = mapped_column(Integer)
+    output_tokens: Mapped[Optional[int]] = mapped_column(Integer)
+    response: Mapped[Optional[str]] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+
+
+class LogEntry(Base):
+    __tablename__ = "log_entries"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    run_id: Mapped[Optional[str]] = mapped_column(String(36), index=True)
+    agent: Mapped[str] = mapped_column(String(64), index=True)
+    type: Mapped[str] = mapped_column(String(32), index=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime, index=True)
+    content: Mapped[Optional[str]] = mapped_column(Text)
+
+
+def _to_json(data) -> str:
+    if isinstance(data, str):
+        return data
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _parse_time(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.now()
+
+
+class RunStore:
+    """Хранилище прогонов в SQLite с пакетной записью из фонового потока"""
+
+    def __init__(
+        self,
+        path: str = RUN_STORE_PATH,
+        batch_size: int = RUN_STORE_BATCH_SIZE,
+        flush_interval: float = RUN_STORE_FLUSH_INTERVAL
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 30})
+        event.listen(self.engine, "connect", self._configure_connection)
+        Base.metadata.create_all(self.engine)
+        self._add_missing_columns()
+
+        self._runs: Dict[str, Dict[str, Any]] = {}
+        self._rows: Dict[type, List[Dict[str, Any]]] = {Stage: [], LLMCall: [], LogEntry: []}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flush_interval = flush_interval
+        self._estimates: Dict[str, tuple] = {}
+        self._thread = threading.Thread(target=self._flush_loop, name="run-store-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _configure_connection(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    def _add_missing_columns(self):
+        """Досоздаёт новые (nullable) колонки в БД, созданной предыдущей версией схемы"""
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing and column.nullable:
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+    # --- Запись ---
+
+    def record_run(self, run_id: str, **fields):
+        """Создаёт или обновляет запись о прогоне (поля объединяются до сброса на диск)"""
+        with self._lock:
+            self._runs.setdefault(run_id, {}).update(fields)
+        self._maybe_flush()
+
+    def record_stage(self, run_id: str, stage_index: int, agent: str, state: Optional[str],
+                     started_at: datetime, duration: float, error: Optional[str] = None):
+        self._append(Stage, {
+            "run_id": run_id,
+            "stage_index": stage_index,
+            "agent": agent,
+            "state": state,
+            "started_at": started_at,
+            "duration": duration,
+            "error": error
+        })
+
+    def record_logs(self, run_id: Optional[str], entries: List[Dict[str, Any]]):
+        """Сохраняет записи логов агентов; записи LLM_CALL дополнительно попадают в llm_calls"""
+        logs, calls = [], []
+        for entry in entries:
+            timestamp = _parse_time(entry.get("timestamp"))
+            content = entry.get("content")
+            if entry.get("type") == "LLM_CALL" and isinstance(content, dict):
+                calls.append({
+                    "run_id": run_id,
+                    "agent": entry.get("agent", ""),
+                    "model": content.get("model"),
+                    "prompt_hash": content.get("prompt_hash", ""),
+                    "latency": content.get("latency"),
+                    "input_tokens": content.get("input_tokens"),
+                    "cached_tokens": content.get("cached_tokens"),
+                    "output_tokens": content.get("output_tokens"),
+                    "response": content.get("response"),
+                    "created_at": timestamp
+                })
+                continue
+            logs.append({
+                "run_id": run_id,
+                "agent": entry.get("agent", ""),
+                "type": entry.get("type", "INFO"),
+                "timestamp": timestamp,
+                "content": _to_json(content)
+            })
+        with self._lock:
+            self._rows[LogEntry].extend(logs)
+            self._rows[LLMCall].extend(calls)
+        self._maybe_flush()
+
+    def _append(self, model: type, row: Dict[str, Any]):
+        with self._lock:
+            self._rows[model].append(row)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        with self._lock:
+            pending = len(self._runs) + sum(len(rows) for rows in self._rows.values())
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Сбрасывает накопленные записи одной транзакцией"""
+        with self._flush_lock:
+            with self._lock:
+                runs, self._runs = self._runs, {}
+                rows = {model: batch for model, batch in self._rows.items() if batch}
+                self._rows = {model: [] for model in self._rows}
+            if not runs and not rows:
+                return
+            with Session(self.engine) as session, session.begin():
+                for run_id, fields in runs.items():
+                    run = session.get(Run, run_id)
+                    if run is None:
+                        session.add(Run(id=run_id, **fields))
+                    else:
+                        for key, value in fields.items():
+                            setattr(run, key, value)
+                for model, batch in rows.items():
+                    session.execute(insert(model), batch)
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[WARNING] Не удалось записать прогоны в {self.path}: {str(e)}")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=self._flush_interval + 1)
+        self.flush()
+
+    # --- Чтение ---
+
+    def find_runs(self, state: Optional[str] = None, since: Optional[datetime] = None,
+                  limit: int = 50) -> List[Run]:
+        query = select(Run).order_by(Run.started_at.desc()).limit(limit)
+        if state:
+            query = query.where(Run.state == state)
+        if since:
+            query = query.where(Run.started_at >= since)
+        with Session(self.engine) as session:
+            return list(session.scalars(query))
+
+    def find_stages(self, agent: Optional[str] = None, state: Optional[str] = None,
+                    run_id: Optional[str] = None, since: Optional[datetime] = None,
+                    limit: int = 50) -> List[Stage]:
+        query = select(Stage).order_by(Stage.started_at.desc()).limit(limit)
+        if agent:
+            query = query.where(Stage.agent == agent)
+        if state:
+            query = query.where(Stage.state == state)
+        if run_id:
+            query = query.where(Stage.run_id == run_id)
+        if since:
+            query = query.where(Stage.started_at >= since)
+        with Session(self.engine) as session:
+            return list(session.scalars(query))
+
+    def expected_stage_seconds(self, agent: str, samples: int = 50) -> Optional[float]:
+        """Медиана длительности последних успешных этапов агента (None — истории нет)"""
+        cached = self._estimates.get(agent)
+        if cached and time.monotonic() - cached[0] < STAGE_ESTIMATE_TTL:
+            return cached[1]
+        query = (
+            select(Stage.duration)
+            .where(Stage.agent == agent, Stage.error.is_(None))
+            .order_by(Stage.started_at.desc())
+            .limit(samples)
+        )
+        with Session(self.engine) as session:
+            durations = sorted(session.scalars(query))
+        estimate = durations[len(durations) // 2] if durations else None
+        self._estimates[agent] = (time.monotonic(), estimate)
+        return estimate
+
+    def find_llm_calls(self, prompt_hash: Optional[str] = None, agent: Optional[str] = None,
+                       run_id: Optional[str] = None, model: Optional[str] = None,
+                       limit: int = 50) -> List[LLMCall]:
+        """Поиск вызовов модели, в том числе по хэшу промпта (для кэша и чекпоинтов)"""
+        query = select(LLMCall).order_by(LLMCall.created_at.desc()).limit(limit)
+        if prompt_hash:
+            query = query.where(LLMCall.prompt_hash == prompt_hash)
+        if agent:
+            query = query.where(LLMCall.agent == agent)
+        if run_id:
+            query = query.where(LLMCall.run_id == run_id)
+        if model:
+            query = query.where(LLMCall.model == model)
+        with Session(self.engine) as session:
+            return list(session.scalars(query))
+
+    def find_logs(self, run_id: Optional[str] = None, agent: Optional[str] = None,
+                  type: Optional[str] = None, since: Optional[datetime] = None,
+                  limit: int = 200) -> List[LogEntry]:
+        query = select(LogEntry).order_by(LogEntry.timestamp).limit(limit)
+        if run_id:
+            query = query.where(LogEntry.run_id == run_id)
+        if agent:
+            query = query.where(LogEntry.agent == agent)
+        if type:
+            query = query.where(LogEntry.type == type)
+        if since:
+            query = query.where(LogEntry.timestamp >= since)
+        with Session(self.engine) as session:
+            return list(session.scalars(query))
+
+
+_stores: Dict[str, RunStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_run_store(path: str = RUN_STORE_PATH) -> RunStore:
+    """Общее на процесс хранилище для файла БД"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = RunStore(path)
+        return _stores[path]
+
+
+def _parse_since(value: Optional[str]) -> Optional[datetime]:
+    """Принимает ISO-дату или относительный период: 30m, 12h, 7d"""
+    if not value:
+        return None
+    units = {"m": "minutes", "h": "hours", "d": "days"}
+    if value[-1] in units and value[:-1].isdigit():
+        return datetime.now() - timedelta(**{units[value[-1]]: int(value[:-1])})
+    return datetime.fromisoformat(value)
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    return {column.name: getattr(row, column.name) for column in row.__table__.columns}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Запросы к хранилищу прогонов агентов")
+    parser.add_argument("--db", default=RUN_STORE_PATH)
+    parser.add_argument("--limit", type=int, default=50)
+    # Общие опции принимаются и после подкоманды; SUPPRESS не затирает значение, данное до неё
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", default=argparse.SUPPRESS)
+    common.add_argument("--limit", type=int, default=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    runs = commands.add_parser("runs", help="Прогоны workflow", parents=[common])
+    runs.add_argument("--state")
+    runs.add_argument("--since")
+
+    stages = commands.add_parser("stages", help="Этапы (запуски агентов)", parents=[common])
+    stages.add_argument("--agent")
+    stages.add_argument("--state")
+    stages.add_argument("--run")
+    stages.add_argument("--since")
+
+    calls = commands.add_parser("calls", help="Вызовы LLM", parents=[common])
+    calls.add_argument("--prompt-hash")
+    calls.add_argument("--agent")
+    calls.add_argument("--run")
+    calls.add_argument("--model")
+
+    logs = commands.add_parser("logs", help="Записи логов агентов", parents=[common])
+    logs.add_argument("--run")
+    logs.add_argument("--agent")
+    logs.add_argument("--type")
+    logs.add_argument("--since")
+
+    args = parser.parse_args(argv)
+    store = RunStore(args.db)
+    if args.command == "runs":
+        rows = store.find_runs(args.state, _parse_since(args.since), args.limit)
+    elif args.command == "stages":
+        rows = store.find_stages(args.agent, args.state, args.run, _parse_since(args.since), args.limit)
+    elif args.command == "calls":
+        rows = store.find_llm_calls(args.prompt_hash, args.agent, args.run, args.model, args.limit)
+    else:
+        rows = store.find_logs(args.run, args.agent, args.type, _parse_since(args.since), args.limit)
+
+    for row in rows:
+        print(json.dumps(_row_to_dict(row), ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+import importlib.util
+import json
+import os
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List
+
+from core.deadline import DeadlineExceeded, current_deadline
+
+SANDBOX_ENABLED = os.getenv("SANDBOX_ENABLED", "1") == "1"
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "10"))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "5"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "512"))
+
+MODULE_NAME = "app_under_test"
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def _warm_worker():
+    """Прогревает воркер: заранее импортирует тяжёлые фреймворки, чтобы форк проверки был дешёвым"""
+    for module in ("flask", "aiohttp.web", "aiohttp.test_utils"):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def _apply_limits(cpu_seconds: int, memory_mb: int):
+    """Ограничивает процессорное время и память текущего процесса"""
+    try:
+        import resource
+    except ImportError:
+        return
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    memory = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+SIOCSIFFLAGS = 0x8914
+IFF_UP, IFF_LOOPBACK, IFF_RUNNING = 0x1, 0x8, 0x40
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND
+# События аудита, которые порождают процессы: в песочнице запрещены все
+PROCESS_EVENTS = {
+    "subprocess.Popen", "os.system", "os.exec", "os.posix_spawn", "os.spawn",
+    "os.fork", "os.forkpty", "pty.spawn", "os.startfile"
+}
+# Вызовы в обход интерпретатора через ctypes (например, libc system()) — тоже запрещены
+NATIVE_EVENTS = {"ctypes.dlopen", "ctypes.dlsym", "ctypes.call_function"}
+# Переменные окружения, которые видит проверяемый код; остальные (в т.ч. ключи API) стираются
+SANDBOX_ENV_KEEP = ("PATH", "LANG", "LC_ALL", "LC_CTYPE", "PYTHONIOENCODING")
+# События, меняющие файловую систему: разрешены только внутри рабочего каталога
+PATH_EVENTS = {
+    "os.remove", "os.rename", "os.rmdir", "os.mkdir", "os.chmod", "os.chown",
+    "os.link", "os.symlink", "os.truncate", "os.utime", "shutil.rmtree", "shutil.move"
+}
+
+
+def _unshare(flags: int) -> bool:
+    if hasattr(os, "unshare"):
+        try:
+            os.unshare(flags)
+            return True
+        except OSError:
+            return False
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    return libc.unshare(flags) == 0
+
+
+def _isolate_network() -> bool:
+    """Переводит процесс в пустое сетевое пространство имён с одним loopback.
+
+    Работает и для дочерних процессов, в отличие от проверок внутри интерпретатора.
+    Без прав root используется пользовательское пространство имён; если ядро
+    не даёт ни того, ни другого, остаётся только аудит-хук (см. _install_guard).
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    if not (_unshare(CLONE_NEWNET) or _unshare(CLONE_NEWUSER | CLONE_NEWNET)):
+        return False
+    import fcntl
+    import struct
+    # Loopback в новом пространстве имён выключен, а он нужен тестовому серверу aiohttp
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        request = struct.pack("16sH14x", b"lo", IFF_UP | IFF_LOOPBACK | IFF_RUNNING)
+        fcntl.ioctl(sock, SIOCSIFFLAGS, request)
+    return True
+
+
+def _inside(path, workdir: str) -> bool:
+    if isinstance(path, int):
+        return True
+    real = os.path.realpath(os.fsdecode(path))
+    return real == os.devnull or real == workdir or real.startswith(workdir + os.sep)
+
+
+def _install_guard(workdir: str):
+    """Аудит-хук процесса проверки: без новых процессов, сети и записи вне workdir.
+
+    Хук нельзя снять из проверяемого кода; процесс проверки после неё завершается.
+    """
+    workdir = os.path.realpath(workdir)
+
+    def guard(event: str, args):
+        if event in PROCESS_EVENTS:
+            raise PermissionError(f"Запуск процессов запрещён в песочнице ({event})")
+        if event in NATIVE_EVENTS:
+            raise PermissionError(f"Нативные вызовы запрещены в песочнице ({event})")
+        if event == "socket.connect":
+            sock, address = args
+            if sock.family in (socket.AF_INET, socket.AF_INET6) and address[0] not in LOOPBACK_HOSTS:
+                raise PermissionError(f"Сетевой доступ запрещён в песочнице: {address[0]}")
+        elif event == "open":
+            path, mode, flags = args
+            writes = (mode is not None and any(c in mode for c in "wax+")) or (flags or 0) & WRITE_FLAGS
+            if writes and path is not None and not _inside(path, workdir):
+                raise PermissionError(f"Запись вне рабочего каталога песочницы: {path}")
+        elif event in PATH_EVENTS:
+            for path in args[:2]:
+                if isinstance(path, (str, bytes, os.PathLike)) and not _inside(path, workdir):
+                    raise PermissionError(f"Изменение файлов вне рабочего каталога песочницы: {path}")
+
+    sys.addaudithook(guard)
+
+
+def _scrub_environment(workdir: str):
+    """Оставляет в окружении процесса проверки только безопасные переменные"""
+    kept = {key: os.environ[key] for key in SANDBOX_ENV_KEEP if key in os.environ}
+    os.environ.clear()
+    os.environ.update(kept, HOME=workdir, TMPDIR=workdir)
+
+
+def _load_module(code: str, workdir: str):
+    """Загружает код как модуль в рабочем каталоге проверки (без запуска блока __main__)"""
+    os.chdir(workdir)
+    path = os.path.join(workdir, f"{MODULE_NAME}.py")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(code)
+    sys.path.insert(0, workdir)
+    spec = importlib.util.spec_from_file_location(MODULE_NAME, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[MODULE_NAME] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _find_app(module):
+    """Ищет в модуле приложение Flask/aiohttp (объект или фабрику create_app)"""
+    candidates = list(vars(module).values())
+    factory = getattr(module, "create_app", None)
+    if callable(factory):
+        try:
+            candidates.insert(0, factory())
+        except TypeError:
+            pass
+    for obj in candidates:
+        cls = type(obj)
+        if cls.__name__ == "Flask" and hasattr(obj, "test_client"):
+            return "flask", obj
+        if cls.__name__ == "Application" and cls.__module__.startswith("aiohttp"):
+            return "aiohttp", obj
+    return None, None
+
+
+def _probe_flask(app) -> List[Dict[str, Any]]:
+    client = app.test_client()
+    results = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == "static" or rule.arguments:
+            continue
+        method = "GET" if "GET" in rule.methods else "POST"
+        if method == "GET":
+            response = client.get(rule.rule)
+        else:
+            response = client.post(rule.rule, json={})
+        results.append({"method": method, "path": rule.rule, "status": response.status_code})
+    return results
+
+
+def _probe_aiohttp(app) -> List[Dict[str, Any]]:
+    import asyncio
+    from aiohttp.test_utils import TestClient, TestServer
+
+    async def probe():
+        results = []
+        async with TestClient(TestServer(app)) as client:
+            for route in app.router.routes():
+                info = route.resource.get_info() if route.resource else {}
+                path = info.get("path")
+                if not path or route.method not in ("GET", "POST"):
+                    continue
+                if route.method == "GET":
+                    response = await client.get(path)
+                else:
+                    response = await client.post(path, json={})
+                results.append({"method": route.method, "path": path, "status": response.status})
+        return results
+
+    return asyncio.run(probe())
+
+
+def _check_import(code: str, workdir: str) -> Dict[str, Any]:
+    _load_module(code, workdir)
+    return {"ok": True}
+
+
+def _check_app(code: str, workdir: str) -> Dict[str, Any]:
+    framework, app = _find_app(_load_module(code, workdir))
+    if framework is None:
+        return {"ok": True, "skipped": "Приложение Flask/aiohttp не найдено"}
+    routes = _probe_flask(app) if framework == "flask" else _probe_aiohttp(app)
+    failed = [r for r in routes if r["status"] >= 500]
+    return {"ok": not failed, "framework": framework, "routes": routes}
+
+
+CHECKS = {
+    "import": _check_import,
+    "app": _check_app,
+}
+
+
+def _execute_check(kind: str, code: str, workdir: str) -> Dict[str, Any]:
+    try:
+        return CHECKS[kind](code, workdir)
+    except ModuleNotFoundError as e:
+        # Отсутствующая зависимость — проблема окружения песочницы, а не сгенерированного кода
+        return {"ok": True, "skipped": f"Нет зависимости: {e.name}"}
+    except BaseException as e:
+        return {
+            "ok": False,
+            "error": f"{type(e).__name__}: {e}",
+            "traceback": traceback.format_exc(limit=5)[-2000:]
+        }
+
+
+def _run_check(kind: str, code: str, timeout: float, cpu_seconds: int, memory_mb: int) -> Dict[str, Any]:
+    """Выполняется в прогретом воркере: форкает изолированный процесс под одну проверку"""
+    started = time.monotonic()
+    workdir = tempfile.mkdtemp(prefix="sandbox_")
+    try:
+        if not hasattr(os, "fork"):
+            result = _execute_check(kind, code, workdir)
+            result["duration"] = round(time.monotonic() - started, 3)
+            return result
+        return _fork_check(kind, code, workdir, started, timeout, cpu_seconds, memory_mb)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _fork_check(kind: str, code: str, workdir: str, started: float, timeout: float,
+                cpu_seconds: int, memory_mb: int) -> Dict[str, Any]:
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        try:
+            _isolate_network()
+            _apply_limits(cpu_seconds, memory_mb)
+            sys.dont_write_bytecode = True
+            _scrub_environment(workdir)
+            tempfile.tempdir = workdir
+            _install_guard(workdir)
+            payload = json.dumps(_execute_check(kind, code, workdir), ensure_ascii=False, default=str)
+        except BaseException as e:
+            payload = json.dumps({"ok": False, "error": f"{type(e).__name__}: {e}"})
+        with os.fdopen(write_fd, "w", encoding="utf-8") as pipe:
+            pipe.write(payload)
+        os._exit(0)
+
+    os.close(write_fd)
+    chunks = []
+    timed_out = False
+    with os.fdopen(read_fd, "rb") as pipe:
+        while True:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                timed_out = True
+                break
+            ready, _, _ = select.select([pipe], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(pipe.fileno(), 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    if timed_out:
+        os.kill(pid, signal.SIGKILL)
+    _, status = os.waitpid(pid, 0)
+    duration = round(time.monotonic() - started, 3)
+
+    if timed_out:
+        return {"ok": False, "error": f"Превышен лимит времени {timeout} с", "duration": duration}
+    if not chunks:
+        if os.WIFSIGNALED(status):
+            reason = signal.Signals(os.WTERMSIG(status)).name
+        else:
+            reason = f"код выхода {os.WEXITSTATUS(status)}"
+        return {"ok": False, "error": f"Процесс проверки аварийно завершился ({reason})", "duration": duration}
+
+    try:
+        result = json.loads(b"".join(chunks).decode("utf-8"))
+    except ValueError:
+        result = {"ok": False, "error": "Некорректный результат проверки"}
+    result["duration"] = duration
+    return result
+
+
+class SandboxError(RuntimeError):
+    """Сбой самой песочницы (пул процессов, fork), а не проверяемого кода"""
+
+
+class CodeSandbox:
+    """Пул прогретых процессов для параллельных smoke-тестов сгенерированного кода"""
+
+    def __init__(
+        self,
+        workers: int = SANDBOX_WORKERS,
+        timeout: float = SANDBOX_TIMEOUT,
+        cpu_seconds: int = SANDBOX_CPU_SECONDS,
+        memory_mb: int = SANDBOX_MEMORY_MB
+    ):
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.broken = False
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker)
+        # Заранее поднимаем воркеры, чтобы первая проверка не платила за их запуск
+        for future in [self._executor.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+    def smoke_test(self, code: str) -> Dict[str, Any]:
+        return self.smoke_test_many([code])[0]
+
+    def smoke_test_many(self, codes: List[str]) -> List[Dict[str, Any]]:
+        """Параллельно прогоняет все проверки для всех артефактов.
+
+        Ожидание ограничено сроком текущего этапа (core.deadline): если он истёк
+        раньше, чем пришли результаты, бросается DeadlineExceeded. Если сломан
+        сам пул, бросается SandboxError; проверка, результат которой не получен
+        из-за сбоя песочницы, помечается пропущенной, а не проваленной.
+        """
+        deadline = current_deadline.get()
+        timeout = self.timeout if deadline is None else min(self.timeout, deadline.remaining())
+        try:
+            futures = [
+                {
+                    kind: self._executor.submit(
+                        _run_check, kind, code, timeout, self.cpu_seconds, self.memory_mb
+                    )
+                    for kind in CHECKS
+                }
+                for code in codes
+            ]
+        except RuntimeError as e:
+            self.broken = True
+            raise SandboxError(f"Пул песочницы недоступен: {e}") from e
+        wait_until = time.monotonic() + timeout + 5
+        if deadline is not None:
+            wait_until = min(wait_until, deadline.expires_at)
+        reports = []
+        for checks in futures:
+            report = {}
+            for kind, future in checks.items():
+                try:
+                    report[kind] = future.result(timeout=max(0.0, wait_until - time.monotonic()))
+                except Exception as e:
+                    if deadline is not None and deadline.expired():
+                        raise DeadlineExceeded("Срок истёк во время smoke-теста") from e
+                    if isinstance(e, BrokenProcessPool):
+                        self.broken = True
+                    report[kind] = {"ok": True, "skipped": f"Сбой песочницы: {type(e).__name__}: {e}"}
+            report["passed"] = all(check["ok"] for check in report.values())
+            reports.append(report)
+        return reports
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+
+
+def get_sandbox() -> CodeSandbox:
+    """Общий на процесс пул песочницы (создаётся при первом обращении, сломанный — пересоздаётся)"""
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is not None and _sandbox.broken:
+            _sandbox.shutdown()
+            _sandbox = None
+        if _sandbox is None:
+            try:
+                _sandbox = CodeSandbox()
+            except Exception as e:
+                raise SandboxError(f"Не удалось запустить песочницу: {type(e).__name__}: {e}") from e
+        return _sandbox
+
+
+def summarize_issues(report: Dict[str, Any]) -> List[str]:
+    """Преобразует отчёт smoke-теста в список проблем для code_review"""
+    issues = []
+    for kind, check in report.items():
+        if kind == "passed" or check.get("ok"):
+            continue
+        if "error" in check:
+            issues.append(f"Smoke-тест '{kind}': {check['error']}")
+        for route in check.get("routes", []):
+            if route["status"] >= 500:
+                issues.append(f"Smoke-тест '{kind}': {route['method']} {route['path']} вернул {route['status']}")
+    return issues
@@ -0,0 +1,66 @@
+import threading
+from typing import Dict, Any, List, Optional, get_origin
+
+from pydantic import BaseModel, ConfigDict
+
+
+class RequirementsVerdict(BaseModel):
+    """Вердикт критика требований"""
+    model_config = ConfigDict(extra="allow")
+
+    approved: bool
+    comments: str
+    score: Optional[int] = None
+
+
+class CodeVerdict(BaseModel):
+    """Вердикт критика кода"""
+    model_config = ConfigDict(extra="allow")
+
+    approved: bool
+    comments: str
+    issues: List[str]
+
+
+class InterfaceContract(BaseModel):
+    """Общий контракт компонентов приложения для map-reduce генерации кода"""
+    data_model: List[str]
+    routes: List[str]
+    page: str
+
+
+def required_fields(model_cls) -> Dict[str, type]:
+    """Обязательные поля модели в виде схемы для StreamingJSONExtractor"""
+    return {
+        name: get_origin(field.annotation) or field.annotation
+        for name, field in model_cls.model_fields.items()
+        if field.is_required()
+    }
+
+
+class ParseStats:
+    """Счётчики успешных и неудачных разборов вердиктов по моделям и режимам"""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, mode: str, ok: bool):
+        with self._lock:
+            counts = self._counts.setdefault(model, {}).setdefault(mode, {"attempts": 0, "failures": 0})
+            counts["attempts"] += 1
+            if not ok:
+                counts["failures"] += 1
+
+    def rates(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                model: {
+                    mode: {**counts, "failure_rate": counts["failures"] / counts["attempts"]}
+                    for mode, counts in modes.items()
+                }
+                for model, modes in self._counts.items()
+            }
+
+
+parse_stats = ParseStats()
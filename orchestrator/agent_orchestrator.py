@@ -1,10 +1,30 @@
-from pathlib import Path
-import json
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from datetime import datetime
 
+from core.deadline import WORKFLOW_TIMEOUT, Deadline, DeadlineExceeded, deadline_scope, is_timeout_error
+from core.run_store import RUN_STORE_PATH, get_run_store
+
+# Сколько этап может доработать после своего бюджета, прежде чем его бросят, с
+STAGE_CANCEL_GRACE = float(os.getenv("STAGE_CANCEL_GRACE", "2"))
+# Сколько workflow пакета одновременно выполняют этап; реальный параллелизм запросов задаёт лимитер
+BATCH_STAGE_CONCURRENCY = int(os.getenv("BATCH_STAGE_CONCURRENCY", "16"))
+# Гарантированные доли оставшегося времени workflow по этапам (см. _stage_budget)
+STAGE_WEIGHTS = {
+    "requirements_writer": 2,
+    "requirements_critic": 1,
+    "code_writer": 4,
+    "code_critic": 2,
+    "reporter": 1
+}
+
 class AgentOrchestrator:
-    def __init__(self, log_file: str = "agent_logs.json"):
-        self.log_file = Path(log_file)
+    def __init__(self, db_path: str = RUN_STORE_PATH):
+        self.store = get_run_store(db_path)
         self.agents = None
         self.workflow = None
         self.thought_log = []
@@ -36,86 +56,221 @@ class AgentOrchestrator:
             ("reporter", lambda x: x.get("state") == self.AgentState.CODE_APPROVED)
         ]
 
-    def execute_workflow(self, user_input):
-        self.initialize_agents()
-        
-        context = {"user_input": user_input, "state": self.AgentState.INIT}
+    def execute_workflow(self, user_input, timeout: float = WORKFLOW_TIMEOUT):
+        """Выполняет workflow целиком; timeout — общий срок, с (0 или None — без срока).
+
+        При нехватке времени возвращается частичный контекст в состоянии TIMEOUT.
+        """
+        # Прогретый оркестратор (планировщик, пакетный раннер) переиспользует агентов и клиентов
+        if self.agents is None:
+            self.initialize_agents()
         
-        for agent_name, condition in self.workflow:
-            if not condition(context):
-                context["state"] = self.AgentState.ERROR
+        context = self.new_context(user_input)
+        deadline = Deadline.after(timeout) if timeout else None
+        stage_index = 0
+        while self.run_stage(context, stage_index, deadline):
+            stage_index += 1
+
+        self._save_final_logs(context)
+        return context
+
+    def execute_batch(self, user_inputs, timeout: float = WORKFLOW_TIMEOUT):
+        """Выполняет пакет workflow «по этапам»: сначала этап 1 у всех, затем этап 2 у выживших и т.д.
+
+        Запросы одного этапа идут к провайдеру вместе и с одинаковым системным
+        префиксом, агенты и клиенты общие на весь пакет. timeout — срок каждого
+        workflow. Возвращает контексты в порядке user_inputs.
+        """
+        if self.agents is None:
+            self.initialize_agents()
+
+        contexts = [self.new_context(user_input) for user_input in user_inputs]
+        deadline = Deadline.after(timeout) if timeout else None
+        logs = {context["run_id"]: [] for context in contexts}
+        survivors = contexts
+        for stage_index in range(len(self.workflow)):
+            if not survivors:
                 break
+            survivors = self.run_stage_batch(survivors, stage_index, deadline, logs)
+
+        for context in contexts:
+            self.thought_log.extend(logs[context["run_id"]])
+            self._save_final_logs(context)
+        return contexts
 
-            agent = self.agents[agent_name]
+    def run_stage_batch(self, contexts, stage_index, deadline: Deadline = None, logs=None):
+        """Выполняет один этап для пакета workflow через Runnable.batch; возвращает выживших.
+
+        logs — run_id -> список, куда пишутся логи агентов каждого workflow.
+        """
+        from langchain_core.runnables import RunnableLambda
+        from core.base_agent import log_sink
+
+        logs = logs if logs is not None else {}
+
+        def step(context):
+            token = log_sink.set(logs.setdefault(context["run_id"], []))
             try:
-                result = self._invoke_with_retry(agent, context)
-                self._log_thoughts(agent)
-                context.update(result)
-            except Exception as e:
-                print(f"Failed at agent {agent_name}: {str(e)}")
+                return self.run_stage(context, stage_index, deadline)
+            finally:
+                log_sink.reset(token)
+
+        agent_name = self.workflow[stage_index][0]
+        results = RunnableLambda(step, name=agent_name).batch(
+            contexts,
+            config={"max_concurrency": BATCH_STAGE_CONCURRENCY},
+            return_exceptions=True
+        )
+        survivors = []
+        for context, result in zip(contexts, results):
+            if isinstance(result, Exception):
+                context["state"] = self.AgentState.ERROR
+                context["error"] = str(result)
+            elif result:
+                survivors.append(context)
+        return survivors
+
+    def new_context(self, user_input):
+        run_id = str(uuid.uuid4())
+        self.store.record_run(
+            run_id,
+            user_input=user_input,
+            state=self.AgentState.INIT.name,
+            started_at=datetime.now()
+        )
+        return {"run_id": run_id, "user_input": user_input, "state": self.AgentState.INIT}
+
+    def run_stage(self, context, stage_index, deadline: Deadline = None):
+        """Выполняет один этап workflow; возвращает True, если можно переходить к следующему.
+
+        С заданным сроком workflow этап получает свою долю оставшегося времени.
+        Этап, который по истории длительностей не успеет, пропускается, а не
+        уложившийся в бюджет — отменяется; в обоих случаях состояние TIMEOUT.
+        """
+        agent_name, condition = self.workflow[stage_index]
+        if not condition(context):
+            context["state"] = self.AgentState.ERROR
+            return False
+
+        agent = self.agents[agent_name]
+        started_at = datetime.now()
+        started = time.monotonic()
+        stage_deadline = None
+        try:
+            if deadline is not None:
+                expected = self.store.expected_stage_seconds(agent.name)
+                if deadline.expired():
+                    self._timeout(context, agent_name, "expired", deadline.remaining(), expected)
+                    return False
+                if expected is not None and expected > deadline.remaining():
+                    self._timeout(context, agent_name, "skipped", deadline.remaining(), expected)
+                    return False
+                stage_deadline = deadline.child(self._stage_budget(stage_index, deadline, expected))
+
+            result = self._invoke_with_retry(agent, context, stage_deadline)
+            self._log_thoughts(agent)
+            context.update(result)
+        except Exception as e:
+            print(f"Failed at agent {agent_name}: {str(e)}")
+            self._log_thoughts(agent)
+            if stage_deadline is not None and (stage_deadline.expired() or is_timeout_error(e)):
+                self._timeout(context, agent_name, "cancelled", stage_deadline.remaining(), None, str(e))
+            else:
                 context["state"] = self.AgentState.ERROR
                 context["error"] = str(e)
-                break
+            return False
+        finally:
+            self.store.record_stage(
+                context.get("run_id"),
+                stage_index,
+                agent.name,
+                context["state"].name,
+                started_at,
+                time.monotonic() - started,
+                context.get("error")
+            )
 
-        self._save_final_logs()
-        return context
+        return stage_index + 1 < len(self.workflow)
 
     @staticmethod
-    def _invoke_with_retry(agent, context):
-        return agent.process_data(context)
+    def metrics():
+        """Метрики процесса: лимитеры запросов к LLM и доля неразобранных вердиктов по моделям"""
+        from core.rate_limiter import rate_limiter_metrics
+        from core.verdicts import parse_stats
+        return {"rate_limiters": rate_limiter_metrics(), "parse_failures": parse_stats.rates()}
+
+    def _stage_budget(self, stage_index, deadline: Deadline, expected=None) -> float:
+        """Оставшееся время workflow за вычетом резерва на следующие этапы.
+
+        Резерв — их типичные длительности по истории (этап без истории не
+        резервирует ничего), поэтому непотраченное время переходит дальше.
+        Доля по весам STAGE_WEIGHTS и типичная длительность самого этапа —
+        нижние границы бюджета.
+        """
+        remaining = deadline.remaining()
+        names = [name for name, _ in self.workflow[stage_index:]]
+        weights = [STAGE_WEIGHTS.get(name, 1) for name in names]
+        share = remaining * weights[0] / sum(weights)
+        reserve = sum(self.store.expected_stage_seconds(self.agents[name].name) or 0 for name in names[1:])
+        return min(remaining, max(share, expected or 0, remaining - reserve))
+
+    def _timeout(self, context, agent_name, reason, remaining, expected=None, error=None):
+        context["state"] = self.AgentState.TIMEOUT
+        context["error"] = error or f"Срок workflow истёк на этапе {agent_name} ({reason})"
+        context["timeout"] = {
+            "stage": agent_name,
+            "reason": reason,
+            "remaining": round(remaining, 3),
+            "expected": expected
+        }
+
+    def _invoke_with_retry(self, agent, context, deadline: Deadline = None):
+        if deadline is None:
+            return agent.process_data(context)
+
+        from core.base_agent import log_sink
+
+        # Этап идёт в отдельном потоке со своим сроком; зависший поток бросается,
+        # а его HTTP-запрос сам завершится по таймауту клиента
+        future = Future()
+        # У потока свой журнал: брошенный поток не допишет в agent.logs, откуда логи забрал бы
+        # следующий прогон. Журнал владельца — журнал пакета или thought_log этого оркестратора
+        owner = log_sink.get()
+        entries = []
+
+        def target():
+            log_sink.set(entries)
+            with deadline_scope(deadline):
+                try:
+                    future.set_result(agent.process_data(dict(context)))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        # Поток получает копию контекста: журнал пакетного выполнения и прочие contextvars
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(target,), name=f"stage-{agent.name}", daemon=True
+        ).start()
+        try:
+            return future.result(timeout=deadline.remaining() + STAGE_CANCEL_GRACE)
+        except FutureTimeout:
+            raise DeadlineExceeded(f"Этап {agent.name} не уложился в срок и отменён")
+        finally:
+            # Снимок: то, что брошенный поток запишет позже, ни в один прогон не попадёт
+            (self.thought_log if owner is None else owner).extend(list(entries))
 
     def _log_thoughts(self, agent):
         for entry in agent.logs:
             self.thought_log.append(entry)
         agent.logs.clear()
 
-    def _save_final_logs(self):
-        print("Trying to save logs:")
-        print(json.dumps(self.thought_log[-1], indent=2, ensure_ascii=False))
-        print("-" * 80)
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            for entry in self.thought_log:
-                try:
-                    # Попытка сохранить как обычный JSON
-                    json.dump(entry, f, ensure_ascii=False, indent=2)
-                    f.write('\n')
-                except Exception as e:
-                    safe_entry = self._make_json_safe(entry)
-                    json.dump(safe_entry, f, ensure_ascii=False, indent=2)
-                    f.write('\n')
-                    print(f"[WARNING] Исправлен невалидный JSON: {str(e)}")
-
-    def _make_json_safe(self, data):
-        def default(o):
-            try:
-                return str(o)
-            except Exception:
-                return repr(o)
-
-        try:
-            cleaned = self._deep_clean(data)
-            return json.loads(json.dumps(cleaned, default=default, ensure_ascii=False))
-        except Exception:
-            return {"error": "Необработанные данные", "raw": str(data)}
-
-    def _deep_clean(self, data):
-        if isinstance(data, dict):
-            return {
-                self._deep_clean(k): self._deep_clean(v)
-                for k, v in data.items()
-            }
-        elif isinstance(data, list):
-            return [self._deep_clean(item) for item in data]
-        elif isinstance(data, str):
-            # Экранируем опасные символы
-            return (
-                data.replace('\\', '\\\\')
-                    .replace('"', '\\"')
-                    .replace('\n', '\\n')
-                    .replace('\r', '\\r')
-                    .replace('\t', '\\t')
-            )
-        elif isinstance(data, (int, float, bool, type(None))):
-            return data
-        else:
-            return str(data)
\ No newline at end of file
+    def _save_final_logs(self, context):
+        """Сохраняет логи и итоговое состояние прогона в хранилище"""
+        run_id = context.get("run_id")
+        self.store.record_logs(run_id, self.thought_log)
+        self.store.record_run(
+            run_id,
+            state=context["state"].name,
+            error=context.get("error"),
+            finished_at=datetime.now()
+        )
+        self.thought_log.clear()
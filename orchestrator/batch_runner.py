@@ -0,0 +1,339 @@
+"""Пакетный раннер: JSONL-поток запросов, распределённый по процессам-воркерам.
+
+Каждый процесс держит несколько потоков с прогретыми AgentOrchestrator, поэтому
+CPU-работа (форматирование логов, ast.parse, разбор JSON, сериализация) идёт
+на всех ядрах. Родитель раскладывает запросы по очередям воркеров, а
+освободившийся воркер с пустой очередью забирает хвост самой длинной чужой
+очереди (work stealing) — долгие прогоны не оставляют отстающих. Результаты
+всех воркеров пишутся в один JSONL, сводные метрики — в stderr или --metrics.
+
+    python -m orchestrator.batch_runner requests.jsonl -o results.jsonl --workers 4 --threads 4
+
+Строка входа — {"input": "...", "id": ...} (id необязателен) или JSON-строка.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(os.cpu_count() or 1)))
+BATCH_THREADS = int(os.getenv("BATCH_THREADS", "4"))
+# Сколько запросов на воркер читается из входа заранее; остальное остаётся в файле
+BATCH_PREFETCH = int(os.getenv("BATCH_PREFETCH", "4"))
+# Счётчики лимитера суммируются по процессам; остальные его значения — мгновенные показания
+LIMITER_COUNTERS = ("requests", "rate_limited", "errors", "throttle_seconds")
+
+
+def read_requests(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Лениво читает JSONL ("-" — stdin); пустые строки пропускаются"""
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        index = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                request = {"error": f"Некорректная строка JSONL: {e}"}
+            if isinstance(request, str):
+                request = {"input": request}
+            yield index, request
+            index += 1
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _context_to_record(context: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-совместимая копия контекста workflow для передачи между процессами"""
+    record = dict(context)
+    if hasattr(record.get("state"), "name"):
+        record["state"] = record["state"].name
+    return json.loads(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def _worker_main(worker_id: int, threads: int, tasks, inbox, db_path: str,
+                 env: Dict[str, str], timeout: Optional[float], verbose: bool):
+    """Процесс-воркер: threads потоков, у каждого свой прогретый AgentOrchestrator"""
+    # Окружение до импортов: лимитер и клиенты читают настройки при импорте
+    os.environ.update(env)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+
+    from core.deadline import WORKFLOW_TIMEOUT
+    from orchestrator.agent_orchestrator import AgentOrchestrator
+
+    def run_thread():
+        orchestrator = AgentOrchestrator(db_path)
+        orchestrator.initialize_agents()
+        while True:
+            inbox.put(("ready", worker_id))
+            task = tasks.get()
+            if task is None:
+                return
+            index, request = task
+            started = time.monotonic()
+            record = {"index": index, "id": request.get("id"), "worker": worker_id}
+            try:
+                if "error" in request:
+                    raise ValueError(request["error"])
+                context = orchestrator.execute_workflow(
+                    request["input"], timeout=WORKFLOW_TIMEOUT if timeout is None else timeout
+                )
+                record.update(_context_to_record(context))
+            except Exception as e:
+                record.update({"state": "EXCEPTION", "error": f"{type(e).__name__}: {e}"})
+            record["elapsed"] = round(time.monotonic() - started, 3)
+            inbox.put(("result", worker_id, record))
+
+    pool = [threading.Thread(target=run_thread, name=f"batch-{worker_id}-{i}") for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    inbox.put(("metrics", worker_id, AgentOrchestrator.metrics()))
+
+
+class ShardedBatchRunner:
+    """Родительская сторона: шардирование входа, work stealing, сбор результатов и метрик"""
+
+    def __init__(
+        self,
+        workers: int = BATCH_WORKERS,
+        threads: int = BATCH_THREADS,
+        prefetch: int = BATCH_PREFETCH,
+        db_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        verbose: bool = False
+    ):
+        from core.run_store import RUN_STORE_PATH
+
+        self.workers = workers
+        self.threads = threads
+        self.prefetch = prefetch
+        self.db_path = db_path or RUN_STORE_PATH
+        self.timeout = timeout
+        self.verbose = verbose
+
+    def _worker_env(self) -> Dict[str, str]:
+        """Каждый процесс получает свою долю общих лимитов провайдера"""
+        from core.rate_limiter import LLM_RPM, LLM_TPM
+
+        return {"LLM_RPM": str(LLM_RPM / self.workers), "LLM_TPM": str(LLM_TPM / self.workers)}
+
+    def run(self, requests: Iterator[Tuple[int, Dict[str, Any]]], output) -> Dict[str, Any]:
+        """Прогоняет запросы; записи результатов пишутся в output по мере готовности"""
+        from core.run_store import get_run_store
+
+        # Схема БД создаётся заранее: иначе воркеры наперегонки выполняют CREATE TABLE
+        get_run_store(self.db_path)
+        mp = multiprocessing.get_context("spawn")
+        inbox = mp.Queue()
+        task_queues = [mp.Queue() for _ in range(self.workers)]
+        env = self._worker_env()
+        # Не daemon: воркеру нужны свои дочерние процессы (пул песочницы CodeCritic)
+        processes = [
+            mp.Process(
+                target=_worker_main,
+                args=(i, self.threads, task_queues[i], inbox, self.db_path, env, self.timeout, self.verbose),
+                name=f"batch-worker-{i}"
+            )
+            for i in range(self.workers)
+        ]
+        try:
+            for process in processes:
+                process.start()
+            report = self._coordinate(processes, task_queues, inbox, requests, output)
+        except BaseException:
+            self._stop(processes, grace=0)
+            raise
+        self._stop(processes)
+        return report
+
+    def _coordinate(self, processes, task_queues, inbox, requests, output) -> Dict[str, Any]:
+        """Раздаёт задачи воркерам по мере готовности, пока не закончится вход или воркеры"""
+        shards: List[deque] = [deque() for _ in range(self.workers)]
+        in_flight: Dict[int, Dict[int, Dict[str, Any]]] = {i: {} for i in range(self.workers)}
+        alive = set(range(self.workers))
+        stats = {
+            "completed": 0,
+            "steals": 0,
+            "requeued": 0,
+            "lost": 0,
+            "states": {},
+            "per_worker": {i: {"completed": 0, "busy_seconds": 0.0} for i in range(self.workers)}
+        }
+        worker_metrics: Dict[int, Dict[str, Any]] = {}
+        source = iter(requests)
+        exhausted = False
+        next_shard = 0
+        started = time.monotonic()
+
+        def refill():
+            nonlocal exhausted, next_shard
+            while not exhausted and sum(len(shard) for shard in shards) < self.prefetch * len(alive):
+                try:
+                    task = next(source)
+                except StopIteration:
+                    exhausted = True
+                    return
+                shard = sorted(alive)[next_shard % len(alive)]
+                shards[shard].append(task)
+                next_shard += 1
+
+        def next_task(worker_id: int):
+            refill()
+            if shards[worker_id]:
+                return shards[worker_id].popleft()
+            victim = max(shards, key=len)
+            if victim:
+                stats["steals"] += 1
+                return victim.pop()
+            return None
+
+        def busy() -> bool:
+            return not exhausted or any(shards) or any(in_flight[i] for i in alive)
+
+        while alive:
+            try:
+                message = inbox.get(timeout=1)
+            except queue.Empty:
+                self._reap(processes, alive, shards, in_flight, stats, worker_metrics)
+                continue
+
+            kind, worker_id = message[0], message[1]
+            if kind == "ready":
+                task = next_task(worker_id) if busy() else None
+                if task is not None:
+                    in_flight[worker_id][task[0]] = task
+                task_queues[worker_id].put(task)
+            elif kind == "result":
+                record = message[2]
+                in_flight[worker_id].pop(record["index"], None)
+                stats["completed"] += 1
+                stats["states"][record.get("state")] = stats["states"].get(record.get("state"), 0) + 1
+                stats["per_worker"][worker_id]["completed"] += 1
+                stats["per_worker"][worker_id]["busy_seconds"] += record.get("elapsed", 0.0)
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+            elif kind == "metrics":
+                worker_metrics[worker_id] = message[2]
+                alive.discard(worker_id)
+
+        # Запросы упавших воркеров, которые некому было передать, и ещё не прочитанный вход
+        stats["lost"] += sum(len(shard) for shard in shards) + sum(1 for _ in source)
+
+        elapsed = time.monotonic() - started
+        return {
+            "workers": self.workers,
+            "threads": self.threads,
+            "elapsed": round(elapsed, 3),
+            "throughput_per_second": round(stats["completed"] / elapsed, 3) if elapsed else None,
+            **stats,
+            "client": merge_metrics(list(worker_metrics.values()))
+        }
+
+    @staticmethod
+    def _stop(processes, grace: float = 5):
+        """Дожидается воркеров; не завершившиеся за grace секунд прерываются"""
+        for process in processes:
+            if process.pid is not None and grace:
+                process.join(timeout=grace)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    @staticmethod
+    def _reap(processes, alive, shards, in_flight, stats, worker_metrics):
+        """Запросы упавшего воркера возвращаются в очереди живых"""
+        for worker_id in list(alive):
+            if processes[worker_id].is_alive():
+                continue
+            processes[worker_id].join()
+            alive.discard(worker_id)
+            worker_metrics.setdefault(worker_id, {})
+            orphans = list(in_flight[worker_id].values()) + list(shards[worker_id])
+            in_flight[worker_id].clear()
+            shards[worker_id].clear()
+            if not alive:
+                stats["lost"] += len(orphans)
+                return
+            for i, task in enumerate(orphans):
+                shards[sorted(alive)[i % len(alive)]].append(task)
+            stats["requeued"] += len(orphans)
+
+
+def merge_metrics(metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сводит AgentOrchestrator.metrics() процессов.
+
+    Счётчики лимитеров и парсинга суммируются; показания лимитеров (concurrency_limit,
+    in_flight, queue_depth) у каждого процесса свои и сводятся в {"max", "mean"}.
+    """
+    limiters: Dict[str, Dict[str, Any]] = {}
+    gauges: Dict[str, Dict[str, List[float]]] = {}
+    parse_failures: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for worker in metrics:
+        for model, values in worker.get("rate_limiters", {}).items():
+            merged = limiters.setdefault(model, {"model": model})
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if key in LIMITER_COUNTERS:
+                    merged[key] = merged.get(key, 0) + value
+                else:
+                    gauges.setdefault(model, {}).setdefault(key, []).append(value)
+        for model, modes in worker.get("parse_failures", {}).items():
+            for mode, counts in modes.items():
+                merged = parse_failures.setdefault(model, {}).setdefault(mode, {"attempts": 0, "failures": 0})
+                merged["attempts"] += counts.get("attempts", 0)
+                merged["failures"] += counts.get("failures", 0)
+    for model, readings in gauges.items():
+        for key, values in readings.items():
+            limiters[model][key] = {"max": max(values), "mean": sum(values) / len(values)}
+    for modes in parse_failures.values():
+        for counts in modes.values():
+            counts["failure_rate"] = counts["failures"] / counts["attempts"] if counts["attempts"] else 0.0
+    return {"rate_limiters": limiters, "parse_failures": parse_failures}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный прогон workflow по JSONL на нескольких процессах")
+    parser.add_argument("input", help="JSONL с запросами (\"-\" — stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL с результатами (\"-\" — stdout)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Число процессов")
+    parser.add_argument("--threads", type=int, default=BATCH_THREADS, help="Потоков (оркестраторов) на процесс")
+    parser.add_argument("--prefetch", type=int, default=BATCH_PREFETCH)
+    parser.add_argument("--timeout", type=float, help="Срок одного workflow, с (по умолчанию WORKFLOW_TIMEOUT)")
+    parser.add_argument("--db", help="Файл хранилища прогонов (по умолчанию RUN_STORE_PATH)")
+    parser.add_argument("--metrics", help="Куда записать сводные метрики (по умолчанию stderr)")
+    parser.add_argument("--verbose", action="store_true", help="Не глушить консольный вывод агентов")
+    args = parser.parse_args(argv)
+
+    runner = ShardedBatchRunner(args.workers, args.threads, args.prefetch, args.db, args.timeout, args.verbose)
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        report = runner.run(read_requests(args.input), output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    summary = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(summary)
+    else:
+        print(summary, file=sys.stderr)
+    # Потерянные запросы (все воркеры упали) — неуспешный прогон
+    return 1 if report["lost"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+from core.deadline import WORKFLOW_TIMEOUT, Deadline
+from core.enums import Priority
+
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+# Каждый N-й запуск этапа отдаётся batch-классу, если он ждёт — защита от голодания
+# (0 — без гарантированной доли: batch получает только то, что не занято interactive)
+SCHEDULER_BATCH_SHARE = int(os.getenv("SCHEDULER_BATCH_SHARE", "5"))
+WAIT_SAMPLES = 1000
+
+
+@dataclass
+class ScheduledRun:
+    run_id: str
+    user_input: str
+    tenant: str
+    priority: Priority
+    deadline: Optional[float]
+    future: Future
+    context: Optional[Dict[str, Any]] = None
+    stage_index: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    thoughts: List[Dict[str, Any]] = field(default_factory=list)
+
+    def sort_key(self):
+        return self.deadline if self.deadline is not None else float("inf")
+
+
+class WorkflowScheduler:
+    """Планировщик workflow с классами приоритета, честным разделением между тенантами и дедлайнами.
+
+    Единица планирования — один этап workflow: после каждого этапа запуск
+    возвращается в очередь, поэтому короткий интерактивный запрос не ждёт
+    окончания длинного batch-прогона.
+    """
+
+    def __init__(
+        self,
+        workers: int = SCHEDULER_WORKERS,
+        orchestrator_factory=None,
+        batch_share: int = SCHEDULER_BATCH_SHARE,
+        tenant_weights: Optional[Dict[str, float]] = None
+    ):
+        if orchestrator_factory is None:
+            from orchestrator.agent_orchestrator import AgentOrchestrator
+            orchestrator_factory = AgentOrchestrator
+        if batch_share != 0 and batch_share < 2:
+            # 1 отдало бы batch-классу строгий приоритет над interactive
+            raise ValueError(f"batch_share должен быть 0 (без доли) или не меньше 2, получено {batch_share}")
+        invalid = {tenant: weight for tenant, weight in (tenant_weights or {}).items() if not weight > 0}
+        if invalid:
+            # Вес входит в знаменатель виртуального времени тенанта
+            raise ValueError(f"Веса тенантов должны быть больше 0, получено {invalid}")
+        self.orchestrator_factory = orchestrator_factory
+        self.batch_share = batch_share
+        self.tenant_weights = tenant_weights or {}
+
+        # priority -> tenant -> heap[(deadline, seq, run)]
+        self._queues = {priority: defaultdict(list) for priority in Priority}
+        # Виртуальное время тенанта: сколько этапов он уже получил с учётом веса
+        self._served = {priority: defaultdict(float) for priority in Priority}
+        self._waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in Priority}
+        self._dispatched = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._log_lock = threading.Lock()
+        self._local = threading.local()
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"scheduler-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self,
+        user_input: str,
+        tenant: str = "default",
+        priority: Priority = Priority.INTERACTIVE,
+        deadline: Optional[float] = WORKFLOW_TIMEOUT or None
+    ) -> Future:
+        """Ставит workflow в очередь; deadline — секунды от текущего момента (None — без срока)"""
+        run = ScheduledRun(
+            run_id=str(uuid.uuid4()),
+            user_input=user_input,
+            tenant=tenant,
+            priority=priority,
+            deadline=time.monotonic() + deadline if deadline is not None else None,
+            future=Future()
+        )
+        self._enqueue(run)
+        return run.future
+
+    def metrics(self) -> Dict[str, Any]:
+        """Время ожидания этапов в очереди по классам приоритета"""
+        with self._cond:
+            result = {}
+            for priority in Priority:
+                waits = sorted(self._waits[priority])
+                queued = sum(len(heap) for heap in self._queues[priority].values())
+                stats = {"queued": queued, "samples": len(waits)}
+                if waits:
+                    stats.update({
+                        "wait_avg": sum(waits) / len(waits),
+                        "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+                        "wait_max": waits[-1]
+                    })
+                result[priority.name] = stats
+            return result
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _enqueue(self, run: ScheduledRun):
+        with self._cond:
+            run.enqueued_at = time.monotonic()
+            queues = self._queues[run.priority]
+            if not queues[run.tenant]:
+                # Вернувшийся тенант не должен получить «накопленный» кредит за простой
+                active = [self._served[run.priority][t] for t, heap in queues.items() if heap]
+                if active:
+                    self._served[run.priority][run.tenant] = max(
+                        self._served[run.priority][run.tenant], min(active)
+                    )
+            heapq.heappush(queues[run.tenant], (run.sort_key(), next(self._seq), run))
+            self._cond.notify()
+
+    def _pick_class(self) -> Optional[Priority]:
+        waiting = [p for p in Priority if any(self._queues[p].values())]
+        if not waiting:
+            return None
+        if (
+            self.batch_share
+            and Priority.BATCH in waiting
+            and len(waiting) > 1
+            and (self._dispatched + 1) % self.batch_share == 0
+        ):
+            return Priority.BATCH
+        return waiting[0]
+
+    def _dequeue(self) -> Optional[ScheduledRun]:
+        priority = self._pick_class()
+        if priority is None:
+            return None
+        queues = self._queues[priority]
+        served = self._served[priority]
+        tenant = min((t for t, heap in queues.items() if heap), key=lambda t: served[t])
+        _, _, run = heapq.heappop(queues[tenant])
+        served[tenant] += 1 / self.tenant_weights.get(tenant, 1.0)
+        self._dispatched += 1
+        self._waits[priority].append(time.monotonic() - run.enqueued_at)
+        return run
+
+    def _orchestrator(self):
+        orchestrator = getattr(self._local, "orchestrator", None)
+        if orchestrator is None:
+            orchestrator = self.orchestrator_factory()
+            orchestrator.initialize_agents()
+            self._local.orchestrator = orchestrator
+        return orchestrator
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                run = self._dequeue()
+                while run is None:
+                    if self._stopped:
+                        return
+                    self._cond.wait()
+                    run = self._dequeue()
+            self._step(run)
+
+    def _step(self, run: ScheduledRun):
+        try:
+            orchestrator = self._orchestrator()
+            if run.context is None:
+                run.context = orchestrator.new_context(run.user_input)
+            # Срок включает ожидание в очереди: истёкший запуск завершается в состоянии TIMEOUT
+            deadline = Deadline(run.deadline) if run.deadline is not None else None
+            proceed = orchestrator.run_stage(run.context, run.stage_index, deadline)
+            run.thoughts.extend(orchestrator.thought_log)
+            orchestrator.thought_log.clear()
+        except Exception as e:
+            run.future.set_exception(e)
+            return
+
+        if proceed:
+            run.stage_index += 1
+            self._enqueue(run)
+            return
+
+        with self._log_lock:
+            orchestrator.thought_log.extend(run.thoughts)
+            orchestrator._save_final_logs(run.context)
+        run.future.set_result(run.context)
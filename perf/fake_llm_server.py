@@ -0,0 +1,297 @@
+"""Локальный OpenAI-совместимый сервер-заглушка для end-to-end замеров без провайдера.
+
+Реализует POST /v1/chat/completions (обычный ответ и SSE-стриминг, tool calls),
+с настраиваемой задержкой, скоростью выдачи токенов, инъекцией 429/5xx и
+заготовленными ответами, выбираемыми по подстроке в промпте агента.
+GET /stats возвращает счётчики сервера.
+
+    python -m perf.fake_llm_server --port 8765 --scenario perf/scenario.json
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+
+DEFAULT_SCENARIO = {
+    # Задержка до первого токена, с (плюс равномерный джиттер)
+    "first_token_latency": 0.2,
+    "jitter": 0.1,
+    "tokens_per_second": 200,
+    # Вероятности инъекции ошибок по HTTP-коду
+    "errors": {"429": 0.0, "500": 0.0, "503": 0.0},
+    "retry_after": 1,
+    "responses": [
+        {
+            "match": "составлению технических требований",
+            "content": "# Технические требования\n\n## Основная функциональность\n- Форма с полем email и кнопкой отправки\n\n## Используемые технологии\n- Flask, Telegram WebApp JS API"
+        },
+        {
+            "match": "анализу требований",
+            "content": "{\"approved\": true, \"comments\": \"Требования полные и выполнимые\", \"score\": 8}"
+        },
+        {
+            "match": "интерфейсный контракт",
+            "content": "{\"data_model\": [\"Subscription(email: str)\"], \"routes\": [\"GET / -> index: - -> HTML\", \"POST /submit -> submit: {email} -> {ok}\"], \"page\": \"Форма email с кнопкой, отправляет POST /submit\"}"
+        },
+        {
+            "match": "ТОЛЬКО слой данных",
+            "content": "```python\nfrom dataclasses import dataclass\n\n\n@dataclass\nclass Subscription:\n    email: str\n\n\nSUBSCRIPTIONS = []\n\n\ndef save_subscription(email):\n    SUBSCRIPTIONS.append(Subscription(email))\n    return True\n```"
+        },
+        {
+            "match": "ТОЛЬКО HTML-страницу",
+            "content": "```python\nINDEX_HTML = \"\"\"<script src='https://telegram.org/js/telegram-web-app.js'></script><form><input name='email'><button>OK</button></form>\"\"\"\n```"
+        },
+        {
+            "match": "ТОЛЬКО Flask-бэкенд",
+            "content": "```python\nfrom flask import Flask, jsonify, render_template_string, request\n\napp = Flask(__name__)\n\n\n@app.route(\"/\")\ndef index():\n    return render_template_string(INDEX_HTML)\n\n\n@app.route(\"/submit\", methods=[\"POST\"])\ndef submit():\n    data = request.get_json(silent=True) or {}\n    return jsonify(ok=save_subscription(data.get(\"email\", \"\")))\n```"
+        },
+        {
+            "match": "Senior Python разработчик",
+            "content": "```python\nfrom flask import Flask, jsonify, request\n\napp = Flask(__name__)\n\n\n@app.route(\"/\")\ndef index():\n    return \"<script src='https://telegram.org/js/telegram-web-app.js'></script><form></form>\"\n\n\n@app.route(\"/submit\", methods=[\"POST\"])\ndef submit():\n    data = request.get_json(silent=True) or {}\n    return jsonify(ok=bool(data.get(\"email\")))\n```"
+        },
+        {
+            "match": "Senior разработчик",
+            "content": "{\"approved\": true, \"comments\": \"Код корректен\", \"issues\": []}"
+        },
+        {
+            "match": "аналитик",
+            "content": "# Итоговый отчет\n\n1. Исходные требования: выполнены\n2. Критика требований: одобрено\n3. Сгенерированный код: Flask WebApp\n4. Результаты код-ревью: одобрено\n5. Итоговые рекомендации: нет"
+        }
+    ],
+    "default_response": "{\"approved\": true, \"comments\": \"ok\", \"issues\": []}"
+}
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _split_tokens(text: str, size: int = 4) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def merge_scenario(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """Накладывает сценарий на DEFAULT_SCENARIO.
+
+    Ответы сценария проверяются первыми, но заготовки по умолчанию остаются:
+    сценарию достаточно переопределить нужных агентов, а не перечислять всех.
+    """
+    merged = {**DEFAULT_SCENARIO, **scenario}
+    merged["errors"] = {**DEFAULT_SCENARIO["errors"], **scenario.get("errors", {})}
+    merged["responses"] = list(scenario.get("responses", [])) + DEFAULT_SCENARIO["responses"]
+    return merged
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, scenario: Dict[str, Any]):
+        super().__init__(address, FakeLLMHandler)
+        self.scenario = merge_scenario(scenario)
+        self.stats = {"requests": 0, "streams": 0, "aborted_streams": 0, "injected_errors": {}}
+        # Хэши системных префиксов, уже «закэшированных» сервером
+        self.seen_prefixes = set()
+        self.lock = threading.Lock()
+
+    def count(self, key: str, amount: int = 1):
+        with self.lock:
+            self.stats[key] += amount
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.lock:
+                self._send_json(200, dict(self.server.stats))
+            return
+        self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count("requests")
+        scenario = self.server.scenario
+
+        error = self._pick_error(scenario)
+        if error:
+            with self.server.lock:
+                injected = self.server.stats["injected_errors"]
+                injected[error] = injected.get(error, 0) + 1
+            headers = {"Retry-After": str(scenario["retry_after"])} if error == "429" else {}
+            self._send_json(int(error), {"error": {"message": f"Injected {error}", "code": int(error)}}, headers)
+            return
+
+        messages = request.get("messages", [])
+        content = self._pick_response(scenario, messages)
+        usage = self._usage(messages, content)
+        time.sleep(scenario["first_token_latency"] + random.uniform(0, scenario["jitter"]))
+
+        if request.get("stream"):
+            self._stream(request, content, usage, scenario)
+        else:
+            time.sleep(usage["completion_tokens"] / scenario["tokens_per_second"])
+            self._send_json(200, self._completion(request, content, usage))
+
+    @staticmethod
+    def _pick_error(scenario: Dict[str, Any]):
+        roll = random.random()
+        for code, probability in scenario["errors"].items():
+            if roll < probability:
+                return code
+            roll -= probability
+        return None
+
+    @staticmethod
+    def _pick_response(scenario: Dict[str, Any], messages: List[Dict[str, Any]]) -> str:
+        system = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+        everything = "\n".join(str(m.get("content", "")) for m in messages)
+        for response in scenario["responses"]:
+            if response["match"] in system:
+                return response["content"]
+        for response in scenario["responses"]:
+            if response["match"] in everything:
+                return response["content"]
+        return scenario["default_response"]
+
+    def _usage(self, messages: List[Dict[str, Any]], content: str) -> Dict[str, Any]:
+        system = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+        prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in messages)
+        prefix = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        with self.server.lock:
+            cached = _estimate_tokens(system) if prefix in self.server.seen_prefixes else 0
+            self.server.seen_prefixes.add(prefix)
+        completion_tokens = _estimate_tokens(content)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached}
+        }
+
+    @staticmethod
+    def _message(request: Dict[str, Any], content: str) -> Dict[str, Any]:
+        tools = request.get("tools")
+        if tools:
+            name = tools[0].get("function", {}).get("name", "tool")
+            return {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": content}
+                }]
+            }
+        return {"role": "assistant", "content": content}
+
+    def _completion(self, request: Dict[str, Any], content: str, usage: Dict[str, Any]) -> Dict[str, Any]:
+        message = self._message(request, content)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"
+            }],
+            "usage": usage
+        }
+
+    def _stream(self, request: Dict[str, Any], content: str, usage: Dict[str, Any], scenario: Dict[str, Any]):
+        self.server.count("streams")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = request.get("model", "fake")
+
+        def chunk(delta, finish_reason=None, with_usage=False):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else []
+            }
+            if with_usage:
+                payload["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        delay = 1 / scenario["tokens_per_second"]
+        try:
+            chunk({"role": "assistant", "content": ""})
+            for piece in _split_tokens(content):
+                time.sleep(delay)
+                chunk({"content": piece})
+            chunk({}, finish_reason="stop")
+            if (request.get("stream_options") or {}).get("include_usage"):
+                chunk(None, with_usage=True)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент оборвал поток (ранняя остановка) — генерация прекращается
+            self.server.count("aborted_streams")
+
+
+def start_server(host: str = "127.0.0.1", port: int = 8765, scenario: Dict[str, Any] = None) -> FakeLLMServer:
+    """Запускает сервер в фоновом потоке (port=0 — любой свободный порт)"""
+    server = FakeLLMServer((host, port), scenario or {})
+    threading.Thread(target=server.serve_forever, name="fake-llm-server", daemon=True).start()
+    return server
+
+
+def load_scenario(path: str = None) -> Dict[str, Any]:
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый сервер-заглушка")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scenario", help="JSON-файл сценария (задержки, ошибки, ответы)")
+    args = parser.parse_args(argv)
+
+    server = FakeLLMServer((args.host, args.port), load_scenario(args.scenario))
+    print(f"Fake LLM server: http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Генератор нагрузки: N параллельных workflow против OpenAI-совместимого endpoint.
+
+По умолчанию поднимает локальный perf.fake_llm_server и гоняет через него
+настоящий клиентский путь (ChatOpenAI, лимитер, планировщик, хранилище).
+
+    python -m perf.load_generator --workflows 50 --concurrency 8
+    python -m perf.load_generator --base-url http://127.0.0.1:8765/v1 --workflows 20
+    python -m perf.load_generator --mode stage_major --workflows 50
+"""
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+import urllib.request
+from typing import Dict, Any, List
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _server_stats(base_url: str) -> Dict[str, Any]:
+    try:
+        with urllib.request.urlopen(base_url.rstrip("/") + "/stats", timeout=5) as response:
+            return json.load(response)
+    except Exception:
+        return {}
+
+
+def run_load(workflows: int, concurrency: int, user_input: str, db_path: str,
+             mode: str = "scheduler") -> Dict[str, Any]:
+    # Импорты после настройки окружения: config.llm_setup читает LLM_BASE_URL при импорте
+    from core.enums import AgentState
+    from orchestrator.agent_orchestrator import AgentOrchestrator
+    from orchestrator.scheduler import WorkflowScheduler
+
+    latencies, states = [], {}
+    started = time.monotonic()
+    if mode == "stage_major":
+        # Весь пакет продвигается этап за этапом; каждый workflow завершается вместе с пакетом
+        orchestrator = AgentOrchestrator(db_path)
+        for context in orchestrator.execute_batch([user_input] * workflows):
+            latencies.append(time.monotonic() - started)
+            states[context["state"].name] = states.get(context["state"].name, 0) + 1
+        queue = None
+    else:
+        scheduler = WorkflowScheduler(
+            workers=concurrency,
+            orchestrator_factory=lambda: AgentOrchestrator(db_path)
+        )
+        submitted = [(time.monotonic(), scheduler.submit(user_input, tenant="load")) for _ in range(workflows)]
+        for submitted_at, future in submitted:
+            try:
+                context = future.result()
+                state = context["state"].name
+            except Exception as e:
+                state = f"EXCEPTION: {type(e).__name__}"
+            latencies.append(time.monotonic() - submitted_at)
+            states[state] = states.get(state, 0) + 1
+        scheduler.shutdown()
+        queue = scheduler.metrics()
+    elapsed = time.monotonic() - started
+
+    failed = workflows - states.get(AgentState.FINISHED.name, 0)
+    return {
+        "mode": mode,
+        "workflows": workflows,
+        "concurrency": concurrency,
+        "elapsed": round(elapsed, 3),
+        "throughput_per_second": round(workflows / elapsed, 3) if elapsed else None,
+        "latency": {
+            "p50": round(percentile(latencies, 0.5), 3),
+            "p90": round(percentile(latencies, 0.9), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(max(latencies), 3) if latencies else 0.0
+        },
+        "error_rate": round(failed / workflows, 3) if workflows else 0.0,
+        "states": states,
+        "queue": queue,
+        "client": AgentOrchestrator.metrics()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон workflow")
+    parser.add_argument("--workflows", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mode", choices=["scheduler", "stage_major"], default="scheduler",
+                        help="scheduler — WorkflowScheduler, stage_major — AgentOrchestrator.execute_batch")
+    parser.add_argument("--input", default="Создай форму с полем email и кнопкой")
+    parser.add_argument("--base-url", help="Endpoint; если не задан, поднимается локальный сервер-заглушка")
+    parser.add_argument("--scenario", help="Сценарий для локального сервера")
+    parser.add_argument("--rpm", type=float, help="Переопределить LLM_RPM клиентского лимитера")
+    parser.add_argument("--verbose", action="store_true", help="Не глушить консольный вывод агентов")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "perf_runs.db"))
+    args = parser.parse_args(argv)
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        from perf.fake_llm_server import load_scenario, start_server
+        server = start_server(port=0, scenario=load_scenario(args.scenario))
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    os.environ["LLM_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "local-perf")
+    if args.rpm is not None:
+        os.environ["LLM_RPM"] = str(args.rpm)
+
+    with open(os.devnull, "w") as devnull:
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with output:
+            report = run_load(args.workflows, args.concurrency, args.input, args.db, args.mode)
+    report["server"] = _server_stats(base_url)
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import io
+import json
+
+from orchestrator.batch_runner import ShardedBatchRunner, merge_metrics
+from perf.fake_llm_server import start_server
+
+
+def test_workflow_end_to_end_with_sandbox(monkeypatch, tmp_path):
+    server = start_server(port=0, scenario={"first_token_latency": 0.01, "jitter": 0.0, "tokens_per_second": 5000})
+    try:
+        # Воркеры запускаются через spawn и читают настройки из унаследованного окружения
+        monkeypatch.setenv("LLM_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setenv("SANDBOX_ENABLED", "1")
+        monkeypatch.setenv("SANDBOX_WORKERS", "1")
+        runner = ShardedBatchRunner(workers=1, threads=1, db_path=str(tmp_path / "runs.db"), timeout=120)
+        output = io.StringIO()
+        report = runner.run(iter([(0, {"id": "a", "input": "Форма подписки на рассылку по email"})]), output)
+    finally:
+        server.shutdown()
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert report["completed"] == 1 and report["lost"] == 0
+    assert records[0]["state"] == "FINISHED", records[0].get("error")
+    assert records[0]["code_review"]["smoke_test"]["passed"] is True
+
+
+def test_merge_metrics_sums_counters_only():
+    worker = {"rate_limiters": {"m": {"model": "m", "requests": 3, "concurrency_limit": 4, "in_flight": 1}}}
+    other = {"rate_limiters": {"m": {"model": "m", "requests": 2, "concurrency_limit": 8, "in_flight": 0}}}
+    merged = merge_metrics([worker, other])["rate_limiters"]["m"]
+    assert merged["requests"] == 5
+    assert merged["concurrency_limit"] == {"max": 8, "mean": 6.0}
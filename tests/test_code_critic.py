@@ -0,0 +1,32 @@
+import pytest
+
+import agents.code_critic as code_critic
+from agents.code_critic import PANEL_ASPECTS, CodeCritic
+
+
+def panel_with_failed_aspect(monkeypatch, voting, failed):
+    """Прогоняет панель, где аспекты из failed падают, а остальные одобряют код"""
+    monkeypatch.setattr(code_critic, "CODE_CRITIC_VOTING", voting)
+    monkeypatch.setattr(code_critic, "CODE_CRITIC_ASPECTS", list(PANEL_ASPECTS))
+
+    def review(prompt, model_cls, instructions):
+        aspect = next(name for name, text in PANEL_ASPECTS.items() if instructions.startswith(text))
+        if aspect in failed:
+            raise RuntimeError("Ошибка при генерации ответа: 503")
+        return {"approved": True, "comments": "ok", "issues": []}
+
+    critic = CodeCritic()
+    monkeypatch.setattr(critic, "_generate_structured", review)
+    return critic._panel_review("Код для проверки:\nprint(1)")
+
+
+def test_unanimous_rejects_when_an_aspect_fails(monkeypatch):
+    result = panel_with_failed_aspect(monkeypatch, "unanimous", {"security"})
+    assert result["approved"] is False
+    assert result["panel"]["security"] is None
+    assert "[security] Ревью аспекта не выполнено" in result["issues"]
+
+
+@pytest.mark.parametrize("failed, approved", [({"security"}, True), ({"security", "performance"}, False)])
+def test_majority_counts_failed_aspects_against(monkeypatch, failed, approved):
+    assert panel_with_failed_aspect(monkeypatch, "majority", failed)["approved"] is approved
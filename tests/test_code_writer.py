@@ -0,0 +1,11 @@
+import ast
+
+from agents.code_writer import CodeWriter
+
+
+def test_merge_keeps_statements_sharing_a_line_with_imports():
+    merged = CodeWriter._merge(["import os; z = 3\nx = 1; import sys", "import os\nprint(z, x)"])
+    ast.parse(merged)
+    assert merged.count("import os") == 1
+    assert "import sys" in merged
+    assert "z = 3" in merged and "x = 1" in merged
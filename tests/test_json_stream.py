@@ -0,0 +1,36 @@
+from core.json_stream import StreamingJSONExtractor
+
+SCHEMA = {"approved": bool, "comments": str}
+ANSWER = {"approved": False, "comments": "final"}
+
+
+def stream(extractor, text, size=3):
+    """Подаёт текст чанками по size символов, как провайдер; None — объект не найден до конца потока"""
+    for i in range(0, len(text), size):
+        result = extractor.feed(text[i:i + size])
+        if result is not None:
+            return result
+    return extractor.finish()
+
+
+def test_skips_think_block():
+    text = '<think>{"approved": true, "comments": "draft"}</think>{"approved": false, "comments": "final"}'
+    assert stream(StreamingJSONExtractor(SCHEMA), text) == ANSWER
+
+
+def test_closing_tag_only_discards_draft_json():
+    text = (
+        'Сначала черновик: {"approved": true, "comments": "draft"} — нет, проверю ещё раз.'
+        '</think>\n{"approved": false, "comments": "final"}'
+    )
+    assert stream(StreamingJSONExtractor(SCHEMA, reasoning=True), text) == ANSWER
+
+
+def test_closing_tag_resets_unfinished_object():
+    text = 'Черновик {"approved": true, "comments": "dr</think>{"approved": false, "comments": "final"}'
+    assert stream(StreamingJSONExtractor(SCHEMA), text, size=1) == ANSWER
+
+
+def test_reasoning_mode_without_think_parses_whole_stream():
+    text = 'Ответ: {"approved": false, "comments": "final"}'
+    assert stream(StreamingJSONExtractor(SCHEMA, reasoning=True), text) == ANSWER